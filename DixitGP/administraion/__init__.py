@@ -1,11 +1,14 @@
 import asyncio
+import io
 import logging
 import shlex
+import time
 
 import aiogram
 from aiogram.utils.markdown import hpre
 
 from logger import get_path as get_log_path
+from utils.scheduler import scheduler, Priority
 
 logger = logging.getLogger('bot.admin')
 from config_reader import config
@@ -19,11 +22,24 @@ admins_ids.extend(
 def register(dp: aiogram.Dispatcher):
     dp.register_message_handler(get_logs, commands=['get_logs'])
     dp.register_message_handler(execute, commands=['exec'])
+    dp.register_message_handler(cache_stats, commands=['cache_stats'])
+    dp.register_message_handler(engine_stats, commands=['engine_stats'])
+    dp.register_message_handler(metrics, commands=['metrics'])
+    dp.register_message_handler(loop_stats, commands=['loop_stats'])
+    dp.register_message_handler(bench_report, commands=['bench_report'])
+    dp.register_message_handler(profile, commands=['profile'])
+
+
+def _reply(message: aiogram.types.Message, *args, **kwargs):
+    return scheduler.call(message.chat.id, message.reply, *args, priority=Priority.INTERACTIVE, **kwargs)
 
 
 async def get_logs(message: aiogram.types.Message):
-    with open(get_log_path(), 'rt') as log_file:
-        await message.reply_document(log_file)
+    async def _send():  # opened per attempt, a retry after RetryAfter sends the whole file again
+        with open(get_log_path(), 'rt') as log_file:
+            return await message.reply_document(log_file)
+
+    await scheduler.call(message.chat.id, _send)
 
 
 async def execute(message: aiogram.types.Message):
@@ -47,9 +63,115 @@ async def execute(message: aiogram.types.Message):
     if stderr:
         text += f'[stderr]\n\n{hpre(stderr.decode())}'
 
-    await message.reply(text)
+    await _reply(message, text)
+
+
+async def cache_stats(message: aiogram.types.Message):
+    if message.from_user.id not in admins_ids:
+        return
+    from utils.card_images import card_images
+    from handlers.game import mentions
+
+    stats = card_images.stats()
+    text = (f"Card images: {stats['hits']} hits / {stats['misses']} misses ({stats['hit_ratio']:.1%})\n"
+            f"{stats['files']} files, {stats['bytes'] / 2 ** 20:.1f} / {stats['max_bytes'] / 2 ** 20:.0f} MiB\n"
+            f"Mentions: {mentions.hits} hits / {mentions.misses} misses ({mentions.hit_ratio:.1%}), "
+            f"{len(mentions)} cached")
+    await _reply(message, hpre(text))
+
+
+async def engine_stats(message: aiogram.types.Message):
+    if message.from_user.id not in admins_ids:
+        return
+    from handlers.game import de
+
+    stats = de.stats()
+    text = (f"Games: {stats['games']} ({stats['scheduled']} scheduled for expiry), players: {stats['players']}\n"
+            f"Memory: {stats['bytes'] / 1024:.1f} KiB, {stats['bytes_per_game']:.0f} B per game\n"
+            f"Prerendered: {stats['prerendered']} cards, "
+            f"{stats['prerender_hits']} hits / {stats['prerender_misses']} misses")
+    actors = sorted(de.actors.stats().items(), key=lambda i: (i[1]['depth'], i[1]['max_latency']), reverse=True)
+    if actors:
+        text += "\n\ngame    depth  done  wait ms  busy ms  max ms"
+    for code, a in actors[:10]:
+        text += (f"\n{code:<7} {a['depth']:>5} {a['processed']:>5} {a['avg_wait'] * 1000:>8.1f}"
+                 f" {a['avg_busy'] * 1000:>8.1f} {a['max_latency'] * 1000:>7.1f}")
+    await _reply(message, hpre(text))
+
+
+async def metrics(message: aiogram.types.Message):
+    if message.from_user.id not in admins_ids:
+        return
+    from utils.metrics import api_metrics
+
+    summary = api_metrics.summary()
+    if not summary:
+        return await _reply(message, "No API requests yet")
+    text = "endpoint            count  err  now   p50 ms   p95 ms   p99 ms   max ms"
+    for endpoint, m in summary.items():
+        text += (f"\n{endpoint[:18]:<18} {m['count']:>6} {m['errors']:>4} {m['in_flight']:>4}"
+                 f" {m['p50'] * 1000:>8.1f} {m['p95'] * 1000:>8.1f} {m['p99'] * 1000:>8.1f} {m['max'] * 1000:>8.1f}")
+    await _reply(message, hpre(text))
+
+
+async def loop_stats(message: aiogram.types.Message):
+    if message.from_user.id not in admins_ids:
+        return
+    from utils.loop_monitor import loop_monitor
+
+    stats = loop_monitor.stats()
+    text = (f"Loop lag over {stats['samples']} samples: p50 {stats['p50'] * 1000:.1f} ms, "
+            f"p95 {stats['p95'] * 1000:.1f} ms, p99 {stats['p99'] * 1000:.1f} ms, max {stats['max'] * 1000:.1f} ms\n"
+            f"Slow callbacks: {stats['slow_callbacks']}")
+    for at, duration, name, handler, update_type in list(loop_monitor.slow)[-5:]:
+        text += (f"\n{time.strftime('%H:%M:%S', time.localtime(at))} {duration * 1000:>6.0f} ms {name}"
+                 + (f" ({handler}, {update_type})" if handler else ""))
+    await _reply(message, hpre(text))
+
+
+async def bench_report(message: aiogram.types.Message):
+    if message.from_user.id not in admins_ids:
+        return
+    import logger as bot_logger
+
+    if message.get_args() == 'reset':
+        bot_logger.timings.clear()
+        bot_logger.failures.clear()
+        return await _reply(message, "Timings cleared")
+    rows = bot_logger.bench_report()
+    if not rows:
+        return await _reply(message, "Nothing timed yet")
+    text = "name                 calls  err  mean ms   p50 ms   p95 ms   p99 ms   max ms"
+    for name, calls, failed, mean, p50, p95, p99, longest in rows:
+        text += (f"\n{name[:20]:<20} {calls:>5} {failed:>4} {mean * 1000:>8.1f} {p50 * 1000:>8.1f}"
+                 f" {p95 * 1000:>8.1f} {p99 * 1000:>8.1f} {longest * 1000:>8.1f}")
+    await _reply(message, hpre(text))
+
+
+async def profile(message: aiogram.types.Message):
+    """ /profile [seconds] [top] - sample the running loop and send collapsed stacks for a flamegraph """
+    if message.from_user.id not in admins_ids:
+        return
+    from utils import profiler
+
+    args = message.get_args().split()
+    try:
+        seconds = min(max(float(args[0]), 1.0), 120.0) if args else 10.0
+        top = int(args[1]) if len(args) > 1 else 15
+    except ValueError:
+        return await _reply(message, "Usage: /profile [seconds] [top]")
+    await _reply(message, f"Profiling for {seconds:.0f} s")
+    try:
+        result = await profiler.profile(seconds)
+    except RuntimeError as e:
+        return await _reply(message, str(e))
+    name = f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded"
+    collapsed = result.collapsed().encode()
+    await scheduler.call(message.chat.id, lambda: message.reply_document(
+        aiogram.types.InputFile(io.BytesIO(collapsed), filename=name), caption="flamegraph.pl or speedscope.app"))
+    await _reply(message, hpre(result.summary(top)[:4000]))
 
 
 async def on_startup(dp: aiogram.Dispatcher):
     for admin_id in admins_ids:
-        await dp.bot.send_message(admin_id, "Started")
+        await scheduler.call(admin_id, dp.bot.send_message, admin_id, "Started")
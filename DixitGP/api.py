@@ -1,63 +1,172 @@
+import asyncio
 import logging
 
 import aiohttp
 import requests
 
 from config_reader import config
+from utils.cache import TTLCache
+from utils.metrics import api_metrics
 
 url = config.API_URL
 
 logger = logging.getLogger("API")
 
+# idempotent endpoints served through the read-through cache
+CACHED_ENDPOINTS = {'get_lobby_info', 'get_game_info', 'get_player_cards', 'active_games'}
+# mutating endpoint -> {request field: cached request field} dropped on call
+INVALIDATES = {
+    'create_game': {'admin_id': 'player_id'},
+    'connect_to_game': {'code': 'code', 'player_id': 'player_id'},
+    'leave_game': {'code': 'code', 'player_id': 'player_id'},
+    'start_game': {'code': 'code'},
+    'send_riddle': {'code': 'code'},
+    'send_association': {'code': 'code'},
+    'send_guess': {'code': 'code'},
+    'add_card': {'player_id': 'player_id'},
+    'add_cards': {'player_id': 'player_id'},
+    'delete_player_card': {'player_id': 'player_id'},
+}
+
 
 class APIError(Exception):
-    pass
+    def __init__(self, *args, status=None):
+        super().__init__(*args)
+        self.status = status
 
 
 class API:
     def __init__(self):
         self.url = config.API_URL
+        self._session: aiohttp.ClientSession | None = None
+        self.cache = TTLCache(maxsize=config.API_CACHE_SIZE, ttl=config.API_CACHE_TTL)
+        self._in_flight: dict[tuple, asyncio.Future] = {}
+        self._generation = 0
+        self._unsupported = set()  # batch endpoints the backend turned out not to have
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=config.API_POOL_LIMIT,
+                limit_per_host=config.API_POOL_LIMIT_PER_HOST,
+                keepalive_timeout=config.API_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=config.API_DNS_CACHE_TTL,
+                use_dns_cache=True,
+            )
+            timeout = aiohttp.ClientTimeout(total=config.API_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def start(self):
+        logger.info(f"API session started for {self.url!r} (limit {config.API_POOL_LIMIT})")
+        return self.session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @staticmethod
+    def _cache_key(endpoint, params):
+        return endpoint, tuple(sorted((params or {}).items()))
+
+    def invalidate(self, **fields):
+        """ Drop cached and in-flight reads whose request has any of `fields` """
+        self._generation += 1
+        for storage in (self.cache.keys(), list(self._in_flight)):
+            for key in storage:
+                params = dict(key[1])
+                if any(name in params and params[name] == value for name, value in fields.items()):
+                    self.cache.pop(key)
+                    self._in_flight.pop(key, None)
+
+    async def request(self, method, endpoint, token=None, session=None, **kwargs):
+        if endpoint in INVALIDATES:
+            params = kwargs.get('json') or {}
+            fields = {cached: params[name] for name, cached in INVALIDATES[endpoint].items() if name in params}
+            self.invalidate(**fields)
+            try:
+                return await self._request(method, endpoint, token, session, **kwargs)
+            finally:
+                # reads started while the mutation was in flight may have seen the old state,
+                # the new generation also keeps those still running from being cached
+                self.invalidate(**fields)
+        if endpoint not in CACHED_ENDPOINTS or set(kwargs) - {'json'}:
+            return await self._request(method, endpoint, token, session, **kwargs)
+
+        # cached results are shared between callers and must be treated as read-only
+        key = self._cache_key(endpoint, kwargs.get('json'))
+        if (data := self.cache.get(key)) is not None:
+            return data
+        if (future := self._in_flight.get(key)) is None:
+            future = asyncio.ensure_future(self._request(method, endpoint, token, session, **kwargs))
+            self._in_flight[key] = future
+            future.add_done_callback(
+                lambda f, generation=self._generation: self._store(key, f, generation))
+        return await asyncio.shield(future)
+
+    def _store(self, key, future, generation):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        if future.cancelled() or future.exception() is not None:
+            return
+        if generation == self._generation:
+            self.cache.set(key, future.result())
 
-    async def request(self, method, endpoint, token=None, **kwargs):
-        async with method(
-                self.url + endpoint,
-                # headers=self.get_default_headers(token or self.token),
-                **kwargs,
-        ) as resp:
-            logger.debug(f"API {endpoint!r} {kwargs} response status {resp.status}")
-            if not resp.ok:
-                try:
-                    error = await resp.json()
-                except aiohttp.ContentTypeError:
-                    error = await resp.text()
-                logger.error(str(error).replace('<', r'\<'))
-                raise APIError(error)
-            data = await resp.json()
-            if isinstance(data, dict) and not data.get("ok", True):
-                raise APIError(data)
+    async def _request(self, method, endpoint, token=None, session=None, **kwargs):
+        session = session or self.session
+        started, status = api_metrics.started(endpoint), 'error'
+        try:
+            async with session.request(
+                    method,
+                    self.url + endpoint,
+                    # headers=self.get_default_headers(token or self.token),
+                    **kwargs,
+            ) as resp:
+                status = resp.status
+                logger.debug("API %r %s response status %s", endpoint, kwargs, resp.status)
+                if not resp.ok:
+                    try:
+                        error = await resp.json()
+                    except aiohttp.ContentTypeError:
+                        error = await resp.text()
+                    logger.error(str(error).replace('<', r'\<'))
+                    raise APIError(error, status=resp.status)
+                data = await resp.json()
+                if isinstance(data, dict) and not data.get("ok", True):
+                    raise APIError(data)
+        except asyncio.TimeoutError:
+            status = 'timeout'
+            raise
+        finally:
+            api_metrics.finished(endpoint, started, status)
         return data
 
-    async def get_active_games(self, session, player_id: int):
+    async def get_active_games(self, player_id: int, session=None):
         result = await self.request(
-            session.get, 'active_games',
+            'get', 'active_games',
+            session=session,
             json={
                 "player_id": player_id,
             },
         )
         return result  # {"ok": true, "codes": [123, 4213, 3]}
 
-    async def get_player_cards(self, session, player_id: int | None = None):
+    async def get_player_cards(self, player_id: int | None = None, session=None):
         result = await self.request(
-            session.get, 'get_player_cards',
+            'get', 'get_player_cards',
+            session=session,
             json={
                 "player_id": player_id,
             },
         )
         return result
 
-    async def add_card(self, session, card_id: str, player_id: int | None = None):
+    async def add_card(self, card_id: str, player_id: int | None = None, session=None):
         result = await self.request(
-            session.get, 'add_card',
+            'get', 'add_card',
+            session=session,
             json={
                 "player_id": player_id,
                 "card_id": card_id,
@@ -65,9 +174,10 @@ class API:
         )
         return result
 
-    async def delete_player_card(self, session, card_id: str, player_id: int | None = None):
+    async def delete_player_card(self, card_id: str, player_id: int | None = None, session=None):
         result = await self.request(
-            session.get, 'delete_player_card',
+            'get', 'delete_player_card',
+            session=session,
             json={
                 "player_id": player_id,
                 "card_id": card_id,
@@ -75,27 +185,30 @@ class API:
         )
         return result
 
-    async def create_game(self, session, admin_id: int):
+    async def create_game(self, admin_id: int, session=None):
         result = await self.request(
-            session.get, 'create_game',
+            'get', 'create_game',
+            session=session,
             json={
                 "admin_id": admin_id,
             },
         )
         return result
 
-    async def get_lobby_info(self, session, code: str):
+    async def get_lobby_info(self, code: str, session=None):
         result = await self.request(
-            session.get, 'get_lobby_info',
+            'get', 'get_lobby_info',
+            session=session,
             json={
                 "code": code,
             },
         )
         return result
 
-    async def connect_to_game(self, session, code: str, player_id: int):
+    async def connect_to_game(self, code: str, player_id: int, session=None):
         result = await self.request(
-            session.get, 'connect_to_game',
+            'get', 'connect_to_game',
+            session=session,
             json={
                 "code": code,
                 "player_id": player_id,
@@ -103,9 +216,10 @@ class API:
         )
         return result
 
-    async def leave_game(self, session, code: str, player_id: int):
+    async def leave_game(self, code: str, player_id: int, session=None):
         result = await self.request(
-            session.get, 'leave_game',
+            'get', 'leave_game',
+            session=session,
             json={
                 "code": code,
                 "player_id": player_id,
@@ -113,36 +227,40 @@ class API:
         )
         return result
 
-    async def start_game(self, session, code: str):
+    async def start_game(self, code: str, session=None):
         result = await self.request(
-            session.get, 'start_game',
+            'get', 'start_game',
+            session=session,
             json={
                 "code": code,
             },
         )
         return result
 
-    async def get_game_info(self, session, code: str):
+    async def get_game_info(self, code: str, session=None):
         result = await self.request(
-            session.get, 'get_game_info',
+            'get', 'get_game_info',
+            session=session,
             json={
                 "code": code,
             },
         )
         return result
 
-    async def get_round_cards(self, session, code: str):
+    async def get_round_cards(self, code: str, session=None):
         result = await self.request(
-            session.get, 'get_round_cards',
+            'get', 'get_round_cards',
+            session=session,
             json={
                 "code": code,
             },
         )
         return result
 
-    async def get_hand(self, session, code: str, player_id: int):
+    async def get_hand(self, code: str, player_id: int, session=None):
         result = await self.request(
-            session.get, 'get_hand',
+            'get', 'get_hand',
+            session=session,
             json={
                 "code": code,
                 "player_id": player_id,
@@ -150,9 +268,67 @@ class API:
         )
         return result
 
-    async def send_riddle(self, session, code: str, player_id: int, riddle: str, card_id: str):
+    async def get_hands(self, code: str, player_ids, session=None):
+        """ {player_id: get_hand result} in one request, or bounded fan-out on older backends """
+        player_ids = list(dict.fromkeys(player_ids))
+        if 'get_hands' not in self._unsupported:
+            try:
+                result = await self.request(
+                    'get', 'get_hands',
+                    session=session,
+                    json={
+                        "code": code,
+                        "player_ids": player_ids,
+                    },
+                )
+                hands = {int(player_id): hand for player_id, hand in result['hands'].items()}
+                return {player_id: {"ok": True, "hand": hands[player_id]} for player_id in player_ids}
+            except APIError as e:
+                self._check_batch_support('get_hands', e)
+
+        hands = await self._fan_out(self.get_hand, [(code, player_id) for player_id in player_ids], session)
+        return dict(zip(player_ids, hands))
+
+    async def add_cards(self, card_ids, player_id: int | None = None, session=None):
+        """ {card_id: add_card result or APIError} in one request, or bounded fan-out on older backends """
+        card_ids = list(dict.fromkeys(card_ids))
+        if 'add_cards' not in self._unsupported:
+            try:
+                await self.request(
+                    'get', 'add_cards',
+                    session=session,
+                    json={
+                        "player_id": player_id,
+                        "card_ids": card_ids,
+                    },
+                )
+                return {card_id: {"ok": True} for card_id in card_ids}
+            except APIError as e:
+                self._check_batch_support('add_cards', e)
+
+        results = await self._fan_out(self.add_card, [(card_id, player_id) for card_id in card_ids], session,
+                                      return_exceptions=True)
+        return dict(zip(card_ids, results))
+
+    def _check_batch_support(self, endpoint, error: APIError):
+        if error.status not in (404, 405, 501):
+            raise error
+        logger.info(f"Backend has no {endpoint} ({error.status}), falling back to single requests")
+        self._unsupported.add(endpoint)
+
+    async def _fan_out(self, method, calls, session=None, return_exceptions=False):
+        semaphore = asyncio.Semaphore(config.API_FANOUT_LIMIT)
+
+        async def _call(args):
+            async with semaphore:
+                return await method(*args, session=session)
+
+        return await asyncio.gather(*(_call(args) for args in calls), return_exceptions=return_exceptions)
+
+    async def send_riddle(self, code: str, player_id: int, riddle: str, card_id: str, session=None):
         result = await self.request(
-            session.get, 'send_riddle',
+            'get', 'send_riddle',
+            session=session,
             json={
                 "code": code,
                 "player_id": player_id,
@@ -162,9 +338,10 @@ class API:
         )
         return result
 
-    async def send_association(self, session, code: str, player_id: int, card_id: str):
+    async def send_association(self, code: str, player_id: int, card_id: str, session=None):
         result = await self.request(
-            session.get, 'send_association',
+            'get', 'send_association',
+            session=session,
             json={
                 "code": code,
                 "player_id": player_id,
@@ -173,9 +350,10 @@ class API:
         )
         return result
 
-    async def send_guess(self, session, code: str, player_id: int, card_id: str):
+    async def send_guess(self, code: str, player_id: int, card_id: str, session=None):
         result = await self.request(
-            session.get, 'send_guess',
+            'get', 'send_guess',
+            session=session,
             json={
                 "code": code,
                 "player_id": player_id,
@@ -0,0 +1,114 @@
+""" Local stand-in for the game server behind `config.API_URL` """
+import asyncio
+import itertools
+import random
+from collections import Counter
+
+from aiohttp import web
+
+HAND_SIZE = 6
+ENDPOINTS = {'create_game', 'connect_to_game', 'leave_game', 'start_game', 'get_lobby_info', 'get_game_info',
+             'get_hand', 'get_hands', 'active_games', 'get_player_cards', 'add_card', 'add_cards'}
+
+
+class FakeBackend:
+    def __init__(self, cards=200, latency=0.0, seed=0):
+        self.cards = [f"card-{i}" for i in range(cards)]
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.games = {}  # code -> {"admin": id, "players": [ids], "started": bool}
+        self.codes = {}  # player -> code
+        self._codes = itertools.count(0x100000)
+        self.runner: web.AppRunner | None = None
+
+    def _game(self, code):
+        if (game := self.games.get(code)) is None:
+            raise LookupError("No game with this code")
+        return game
+
+    def create_game(self, admin_id):
+        code = f"{next(self._codes):06X}"
+        self.games[code] = {"admin": admin_id, "players": [admin_id], "started": False}
+        self.codes[admin_id] = code
+        return {"code": code}
+
+    def connect_to_game(self, code, player_id):
+        game = self._game(code)
+        if player_id in game["players"]:
+            raise LookupError("Player already exists")
+        game["players"].append(player_id)
+        self.codes[player_id] = code
+        return {}
+
+    def leave_game(self, code, player_id):
+        game = self._game(code)
+        if player_id in game["players"]:
+            game["players"].remove(player_id)
+        self.codes.pop(player_id, None)
+        return {}
+
+    def start_game(self, code):
+        self._game(code)["started"] = True
+        return {}
+
+    def get_lobby_info(self, code):
+        game = self._game(code)
+        return {"players": [{"player_id": player, "role": "admin" if player == game["admin"] else "player"}
+                            for player in game["players"]]}
+
+    def get_game_info(self, code):
+        game = self._game(code)
+        return {"game_info": {
+            "win_score": 30,
+            "author": {"player_id": game["admin"]},
+            "players": [{"player_id": player} for player in game["players"] if player != game["admin"]],
+        }}
+
+    def get_hand(self, code, player_id):
+        self._game(code)
+        return {"hand": self.random.sample(self.cards, HAND_SIZE)}
+
+    def get_hands(self, code, player_ids):
+        self._game(code)
+        return {"hands": {str(player): self.random.sample(self.cards, HAND_SIZE) for player in player_ids}}
+
+    def active_games(self, player_id):
+        return {"codes": [self.codes[player_id]] if player_id in self.codes else []}
+
+    def get_player_cards(self, player_id=None):
+        return {"cards": self.cards if player_id is None else []}
+
+    def add_card(self, card_id, player_id=None):
+        return {}
+
+    def add_cards(self, card_ids, player_id=None):
+        return {}
+
+    async def handle(self, request: web.Request):
+        endpoint = request.match_info['endpoint']
+        self.calls[endpoint] += 1
+        params = await request.json() if request.can_read_body else {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if endpoint not in ENDPOINTS:
+            return web.json_response({"ok": False, "error_message": f"Unknown endpoint {endpoint}"}, status=404)
+        try:
+            result = getattr(self, endpoint)(**params)
+        except LookupError as e:
+            return web.json_response({"ok": False, "error_message": str(e)})
+        return web.json_response({"ok": True, **result})
+
+    async def start(self, host='127.0.0.1', port=0):
+        """ Serve and return the url for `config.API_URL` """
+        app = web.Application()
+        app.router.add_route('*', '/{endpoint}', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        return f"http://{host}:{site._server.sockets[0].getsockname()[1]}/"
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
@@ -0,0 +1,85 @@
+""" Local stand-in for the Telegram Bot API, just enough of it for the game flows """
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+
+from aiohttp import web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Dixit", "username": "dixit_load_bot"}
+
+
+class FakeTelegram:
+    def __init__(self, card: bytes, latency=0.0):
+        self.card = card  # every file download returns these bytes
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1000)
+        self._file_ids = itertools.count(1)
+        self.runner: web.AppRunner | None = None
+
+    def message(self, chat_id, text=None, message_id=None, **fields):
+        message = {
+            "message_id": message_id or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            **fields,
+        }
+        if text is not None:
+            message["text"] = text
+        return message
+
+    def photo(self):
+        file_id = f"sent-{next(self._file_ids)}"
+        return [{"file_id": file_id, "file_unique_id": f"u{file_id}", "width": 1280, "height": 960}]
+
+    async def handle(self, request: web.Request):
+        method = request.match_info['method']
+        self.calls[method] += 1
+        data = await request.post()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = int(data['chat_id']) if 'chat_id' in data else None
+        if method == 'getMe':
+            result = BOT_USER
+        elif method == 'sendMessage':
+            result = self.message(chat_id, data.get('text'))
+        elif method == 'editMessageText':
+            result = self.message(chat_id, data.get('text'), int(data['message_id']))
+        elif method == 'sendMediaGroup':
+            media = json.loads(data['media'])
+            group = str(next(self._message_ids))
+            result = [self.message(chat_id, photo=self.photo(), media_group_id=group) for _ in media]
+        elif method == 'getChat':
+            result = {"id": chat_id, "type": "private", "first_name": f"user{chat_id}", "username": f"user{chat_id}"}
+        elif method == 'getFile':
+            file_id = data['file_id']
+            result = {"file_id": file_id, "file_unique_id": f"u{file_id}", "file_size": len(self.card),
+                      "file_path": f"photos/{file_id}.jpg"}
+        else:  # answerCallbackQuery, sendChatAction, setMyCommands ...
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def download(self, request: web.Request):
+        self.calls['download'] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.Response(body=self.card, content_type="image/jpeg")
+
+    async def start(self, host='127.0.0.1', port=0):
+        """ Serve and return the base url for `TelegramAPIServer.from_base` """
+        app = web.Application(client_max_size=64 * 2 ** 20)
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        app.router.add_get('/file/bot{token}/{path:.*}', self.download)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        return f"http://{host}:{site._server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
@@ -0,0 +1,244 @@
+"""
+Offline load test: fake Bot API + fake game server, synthetic updates through `dp.process_update`.
+python -m benchmarks.load [--games 500] [--players 4] [--ramp 5] [--latency 0.02]
+"""
+import argparse
+import asyncio
+import io
+import itertools
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from benchmarks.fake_backend import FakeBackend
+from benchmarks.fake_telegram import FakeTelegram, BOT_USER
+
+STEPS = ('start', 'create', 'connect', 'code', 'start_game')
+
+
+class Fakes:
+    """ Both fakes on their own loop and thread, so they do not show up in the bot's loop lag """
+
+    def __init__(self, telegram: FakeTelegram, backend: FakeBackend):
+        self.telegram = telegram
+        self.backend = backend
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="fakes", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        telegram_url = asyncio.run_coroutine_threadsafe(self.telegram.start(), self.loop).result()
+        backend_url = asyncio.run_coroutine_threadsafe(self.backend.start(), self.loop).result()
+        return telegram_url, backend_url
+
+    def stop(self):
+        for fake in (self.telegram, self.backend):
+            asyncio.run_coroutine_threadsafe(fake.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+def make_card(width, height):
+    """ Noisy gradient jpeg, every download returns it """
+    import numpy as np
+    from PIL import Image
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.stack([x * 0.15, y * 0.2, (x + y) * 0.1], axis=-1) + rng.normal(0, 12, (height, width, 3))
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), "RGB").save(buffer, format="jpeg", quality=90)
+    return buffer.getvalue()
+
+
+def configure(backend_url, folder, real_limits):
+    """ Point the bot at the fakes before `config` is imported, caches go to a temporary folder """
+    os.environ.setdefault("BOT_TOKEN", "123456:load-test")
+    os.environ.setdefault("ADMINS_IDS", "0")
+    os.environ["API_URL"] = backend_url
+    os.environ["STORAGE_URL"] = "memory://"
+    os.environ["FILE_ID_CACHE_PATH"] = os.path.join(folder, "file_ids.sqlite3")
+    os.environ["CARD_CACHE_PATH"] = os.path.join(folder, "cards")
+    os.environ["CARD_INDEX_PATH"] = os.path.join(folder, "card_index.sqlite3")
+    if not real_limits:  # measure the bot, not telegram's flood limits
+        for name in ("TG_RATE", "TG_BURST", "TG_CHAT_RATE", "TG_CHAT_BURST"):
+            os.environ[name] = "1000000"
+
+
+class LoadTest:
+    def __init__(self, dp, backend: FakeBackend):
+        self.dp = dp
+        self.backend = backend
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        from utils.metrics import Histogram
+        self.steps = defaultdict(Histogram)
+        self.flows = Histogram()
+        self.loop_lag = Histogram()
+        self.errors = defaultdict(int)
+        self.updates = 0
+
+    @staticmethod
+    def user(user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+
+    def message(self, user_id, text):
+        message = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self.user(user_id),
+            "text": text,
+        }
+        if text.startswith('/'):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"message": message}
+
+    def callback(self, user_id, data):
+        message = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": BOT_USER,
+            "text": "Вітаю, обери дію 😌",
+        }
+        return {"callback_query": {"id": str(next(self.update_ids)), "from": self.user(user_id),
+                                   "chat_instance": str(user_id), "message": message, "data": data}}
+
+    async def feed(self, step, update):
+        from aiogram import types
+        update = types.Update(update_id=next(self.update_ids), **update)
+        started = time.perf_counter()
+        try:
+            # own task per update like polling does, aiogram caches the FSM state in the task's context
+            await asyncio.ensure_future(self.dp.process_update(update))
+        except Exception as e:
+            self.errors[step] += 1
+            if self.errors[step] <= 3:
+                print(f"{step} failed: {e!r}")
+        finally:
+            self.steps[step].observe(time.perf_counter() - started)
+            self.updates += 1
+
+    async def game(self, index, players, delay):
+        from handlers.start import start_callbacks
+        await asyncio.sleep(delay)
+        started = time.perf_counter()
+        admin = 10_000 + index * 100
+        await self.feed('start', self.message(admin, '/start'))
+        await self.feed('create', self.callback(admin, start_callbacks.new(type='create')))
+        if not (code := self.backend.codes.get(admin)):
+            return
+
+        async def _join(player):
+            await self.feed('start', self.message(player, '/start'))
+            await self.feed('connect', self.callback(player, start_callbacks.new(type='connect')))
+            await self.feed('code', self.message(player, code))
+
+        await asyncio.gather(*(_join(admin + i) for i in range(1, players + 1)))
+        await self.feed('start_game', self.callback(admin, start_callbacks.new(type='start')))
+        self.flows.observe(time.perf_counter() - started)
+
+    async def sample_loop_lag(self, interval=0.01):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag.observe(max(0.0, loop.time() - started - interval))
+
+    async def run(self, games, players, ramp):
+        sampler = asyncio.ensure_future(self.sample_loop_lag())
+        started = time.perf_counter()
+        await asyncio.gather(*(self.game(i, players, ramp * i / games) for i in range(games)))
+        elapsed = time.perf_counter() - started
+        await self.drain()
+        sampler.cancel()
+        return elapsed
+
+    async def drain(self):
+        """ Wait for debounced lobby edits and queued sends to finish """
+        from handlers.game import de, LOBBY_DEBOUNCE
+        from utils.scheduler import scheduler
+        await asyncio.sleep(LOBBY_DEBOUNCE)
+        while de._lobby_refreshes or any(scheduler.stats()["queued"].values()) or scheduler.stats()["running"]:
+            await asyncio.sleep(0.05)
+
+
+def row(name, histogram, errors=0):
+    return (f"{name:<12} {histogram.count:>7} {errors:>5} {histogram.quantile(0.5) * 1000:>9.1f}"
+            f" {histogram.quantile(0.95) * 1000:>9.1f} {histogram.quantile(0.99) * 1000:>9.1f}"
+            f" {histogram.max * 1000:>9.1f}")
+
+
+async def main(args):
+    card = make_card(args.card_width, args.card_height)
+    telegram, backend = FakeTelegram(card, args.latency), FakeBackend(args.cards, args.backend_latency)
+    fakes = Fakes(telegram, backend)
+    telegram_url, backend_url = fakes.start()
+    folder = tempfile.mkdtemp(prefix="dixit-load-")
+    configure(backend_url, folder, args.real_limits)
+
+    import aiogram
+    from aiogram.bot.api import TelegramAPIServer
+    import administraion
+    import handlers
+    from api import api
+    from handlers.game import de
+    from storage import KVStorage, store
+    from utils.duplicates import card_index
+    from utils.file_ids import file_ids
+    from utils.render import renderer
+    from utils.scheduler import scheduler
+
+    bot = aiogram.Bot(os.environ["BOT_TOKEN"], parse_mode='HTML', server=TelegramAPIServer.from_base(telegram_url))
+    dp = aiogram.Dispatcher(bot, storage=KVStorage(store))
+    handlers.register(dp)
+    administraion.register(dp)
+    aiogram.Bot.set_current(bot)
+    aiogram.Dispatcher.set_current(dp)
+    await api.start()
+    await card_index.load()
+
+    test = LoadTest(dp, backend)
+    try:
+        elapsed = await test.run(args.games, args.players, args.ramp)
+    finally:
+        await api.close()
+        renderer.shutdown()
+        await scheduler.stop()
+        await store.close()
+        await file_ids.close()
+        await card_index.close()
+        await (await bot.get_session()).close()
+        fakes.stop()
+
+    users = args.players + 1
+    print(f"{args.games} games x {users} users, {test.updates} updates in {elapsed:.1f} s: "
+          f"{test.updates / elapsed:.0f} updates/s, {test.flows.count / elapsed:.1f} games/s")
+    print(f"{'step':<12} {'count':>7} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for step in STEPS:
+        print(row(step, test.steps[step], test.errors[step]))
+    print(row('game flow', test.flows, args.games - test.flows.count))
+    print(row('loop lag', test.loop_lag))
+    print("bot api:", ", ".join(f"{k} {v}" for k, v in telegram.calls.most_common()))
+    print("backend:", ", ".join(f"{k} {v}" for k, v in backend.calls.most_common()))
+    print("engine:", de.stats())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--games", type=int, default=500)
+    parser.add_argument("--players", type=int, default=4, help="players joining each game besides its admin")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which games are started")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake Bot API latency, seconds")
+    parser.add_argument("--backend-latency", type=float, default=0.005, help="fake game server latency, seconds")
+    parser.add_argument("--cards", type=int, default=200, help="distinct cards hands are drawn from")
+    parser.add_argument("--card-width", type=int, default=1280)
+    parser.add_argument("--card-height", type=int, default=960)
+    parser.add_argument("--real-limits", action="store_true", help="keep the TG_* rate limits from config")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,80 @@
+""" Logging throughput, direct file handlers + f-strings vs the queue pipeline + lazy %: python -m benchmarks.log_throughput [records] """
+import logging
+import os
+import sys
+import tempfile
+import time
+from logging.handlers import RotatingFileHandler
+
+import logger as bot_logger
+
+PAYLOAD = {"code": "26F8F5", "player_id": 738016227, "cards": [f"AgACAgIAAxkBAAI{i:04d}" for i in range(6)]}
+
+
+def direct_logging(folder, stream):
+    """ What init_logging used to do: both handlers on the root logger, written by the caller """
+    formatter = logging.Formatter(
+        '%(levelname)-6s [%(asctime)s] %(message)-100s      <%(name)s:%(filename)s:%(lineno)d ~%(threadName)s~>')
+    fh = RotatingFileHandler(os.path.join(folder, "direct.log"), maxBytes=30 * 1024 * 1024, backupCount=1,
+                             encoding="utf-8")
+    ch = logging.StreamHandler(stream)
+    for handler in (fh, ch):
+        handler.setFormatter(formatter)
+        logging.root.addHandler(handler)
+    logging.root.setLevel(logging.INFO)
+
+
+def reset():
+    bot_logger.stop_logging()
+    for handler in list(logging.root.handlers):
+        logging.root.removeHandler(handler)
+        handler.close()
+
+
+def measure(log, count):
+    """ (seconds per call on the caller, worst call) """
+    worst = 0.0
+    started = time.perf_counter()
+    for i in range(count):
+        call = time.perf_counter()
+        log(i)
+        worst = max(worst, time.perf_counter() - call)
+    return (time.perf_counter() - started) / count, worst
+
+
+def main(count=50_000):
+    log = logging.getLogger("handlers")
+    folder = tempfile.mkdtemp(prefix="dixit-logs-")
+    devnull = open(os.devnull, "w")
+
+    direct_logging(folder, devnull)
+    started = time.perf_counter()
+    before, before_worst = measure(lambda i: log.info(f"start_game by user {i}, {PAYLOAD}"), count)
+    before_total = time.perf_counter() - started
+    before_debug, _ = measure(lambda i: log.debug(f"API {'get_hands'!r} {PAYLOAD} response status {200}"), count)
+    reset()
+
+    bot_logger.FOLDER = folder
+    bot_logger.QUEUE_SIZE = 2 * count + 1  # measure throughput, not the drop policy
+    stdout, sys.stdout = sys.stdout, devnull
+    try:
+        bot_logger.init_logging()
+    finally:
+        sys.stdout = stdout
+    started = time.perf_counter()
+    after, after_worst = measure(lambda i: log.info("start_game by user %s, %s", i, PAYLOAD), count)
+    after_debug, _ = measure(lambda i: log.debug("API %r %s response status %s", 'get_hands', PAYLOAD, 200), count)
+    dropped = bot_logger._listener.queue_handler.dropped
+    reset()  # waits for the writer thread to drain the queue
+    after_total = time.perf_counter() - started - after_debug * count
+
+    print(f"{count} records")
+    print(f"direct + f-string   {before * 1e6:7.1f} us/call on the loop, worst {before_worst * 1000:.2f} ms, "
+          f"{count / before_total:.0f} records/s written")
+    print(f"queue + lazy %      {after * 1e6:7.1f} us/call on the loop, worst {after_worst * 1000:.2f} ms, "
+          f"{count / after_total:.0f} records/s written, {dropped} dropped")
+    print(f"disabled debug      {before_debug * 1e6:7.2f} us f-string, {after_debug * 1e6:.2f} us lazy")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,75 @@
+""" Watermark micro-benchmark: python -m benchmarks.watermark [photos count] """
+import io
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+from utils import watermark
+
+SIZE = (1280, 960)
+LABELS = range(1, 7)
+
+
+def reference_marked_image(original, text):
+    """ Previous full-frame RGBA implementation, kept as the pixel reference """
+    text = str(text)
+    if original.mode != "RGBA":
+        img = Image.new("RGBA", original.size, (0, 0, 0, 0))
+        img.paste(original)
+        original = img
+    full_mark = Image.new("RGBA", original.size, (0, 0, 0, 0))
+    mark = watermark.get_circle_mark(text, int(min(original.size) * 0.30))
+    offset = int(min(original.size) * 0.05)
+    full_mark.paste(mark, (offset, offset))
+    return Image.alpha_composite(original, full_mark).convert("RGB")
+
+
+def make_photos(count):
+    """ Smooth gradients plus noise, so JPEG behaves roughly like on real photos """
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:SIZE[1], 0:SIZE[0]]
+    photos = []
+    for _ in range(count):
+        base = np.stack([x * rng.uniform(0.1, 0.2), y * rng.uniform(0.1, 0.3), (x + y) * 0.1], axis=-1)
+        noise = rng.normal(0, 12, base.shape)
+        photos.append(Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8), "RGB"))
+    return photos
+
+
+def jpeg_roundtrip(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="jpeg")
+    buffer.seek(0)
+    return np.asarray(Image.open(buffer), dtype=np.int16)
+
+
+def measure(func, photos):
+    func(photos[0], 1)  # warm mark caches
+    start = time.perf_counter()
+    for photo in photos:
+        for label in LABELS:
+            func(photo, label)
+    return (time.perf_counter() - start) / (len(photos) * len(LABELS))
+
+
+def main(count=8):
+    photos = make_photos(count)
+
+    raw_diff = jpeg_diff = 0
+    for label in LABELS:
+        expected, actual = reference_marked_image(photos[0], label), watermark.get_marked_image(photos[0], label)
+        raw_diff = max(raw_diff, int(np.abs(np.asarray(expected, np.int16) - np.asarray(actual, np.int16)).max()))
+        jpeg_diff = max(jpeg_diff, int(np.abs(jpeg_roundtrip(expected) - jpeg_roundtrip(actual)).max()))
+
+    reference = measure(reference_marked_image, photos)
+    current = measure(watermark.get_marked_image, photos)
+    print(f"{SIZE[0]}x{SIZE[1]}, {count} photos x {len(LABELS)} labels")
+    print(f"reference  {reference * 1000:8.2f} ms/image")
+    print(f"roi numpy  {current * 1000:8.2f} ms/image  x{reference / current:.1f}")
+    print(f"max pixel diff: raw {raw_diff}, after jpeg {jpeg_diff}")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -6,6 +6,55 @@ class Settings(BaseSettings):
     ADMINS_IDS: str
     API_URL: str
 
+    API_POOL_LIMIT: int = 100
+    API_POOL_LIMIT_PER_HOST: int = 30
+    API_KEEPALIVE_TIMEOUT: float = 30
+    API_DNS_CACHE_TTL: int = 300
+    API_TIMEOUT: float = 30
+    API_CACHE_TTL: float = 2
+    API_CACHE_SIZE: int = 1024
+    API_FANOUT_LIMIT: int = 8
+
+    RENDER_EXECUTOR: str = 'thread'  # 'thread' or 'process'
+    RENDER_WORKERS: int = 0  # 0 - one per core
+    RENDER_QUEUE_SIZE: int = 32
+    RENDER_MAX_SIDE: int = 1280  # telegram downscales bigger photos anyway
+    RENDER_MAX_FRAMES: int = 0  # decoded frames at once, 0 - one per core
+
+    FILE_ID_CACHE_PATH: str = 'cache/file_ids.sqlite3'
+    FILE_ID_CACHE_SIZE: int = 100_000
+
+    CARD_CACHE_PATH: str = 'cache/cards'
+    CARD_CACHE_BYTES: int = 512 * 1024 * 1024
+    CARD_INDEX_PATH: str = 'cache/card_index.sqlite3'
+    DUPLICATE_MAX_DISTANCE: int = 6  # max differing dHash bits for two photos to be the same card
+
+    TG_RATE: float = 25  # Bot API calls per second over all chats
+    TG_BURST: int = 30
+    TG_CHAT_RATE: float = 1  # per chat
+    TG_CHAT_BURST: int = 3
+    TG_MAX_RETRIES: int = 3
+
+    STORAGE_URL: str = 'sqlite:///cache/state.sqlite3'  # memory:// | sqlite:///path | redis://host:port/db
+    STORAGE_FLUSH_INTERVAL: float = 0.05
+    STORAGE_CACHE_TTL: float = 1
+
+    MODE: str = 'polling'  # 'polling' or 'webhook'
+    WEBHOOK_URL: str = ''  # public https base url, e.g. https://bot.example.com
+    WEBHOOK_PATH: str = '/webhook'
+    WEBHOOK_HOST: str = '0.0.0.0'
+    WEBHOOK_PORT: int = 8080
+    WEBHOOK_MAX_CONNECTIONS: int = 40
+    WEBHOOK_QUEUE_SIZE: int = 1000  # per worker, the front answers 503 when it is full
+    WORKERS: int = 1
+
+    METRICS_HOST: str = '127.0.0.1'
+    METRICS_PORT: int = 0  # prometheus /metrics endpoint, 0 - disabled; webhook worker N listens on port + N
+
+    LOOP_MONITOR_INTERVAL: float = 0.1  # seconds between loop lag samples
+    LOOP_MONITOR_WINDOW: float = 600  # seconds of samples kept for percentiles
+    LOOP_SLOW_CALLBACK: float = 0.1  # callbacks running longer than this are logged
+
     class Config:
         env_file = '.env'
         env_file_encoding = 'utf-8'
@@ -1,18 +1,25 @@
 import asyncio
 import io
+import logging
 import os.path
 import time
-from collections import defaultdict
 from pathlib import Path
 
 import aiogram
-import aiohttp
 from PIL import Image
 from aiogram.types import ContentType, Message, PhotoSize, MediaGroup, InputMedia, InputMediaPhoto, InputFile, \
     ChatActions
 
 from api import api
 from utils import watermark
+from utils.duplicates import card_index, dhash
+from utils.scheduler import scheduler, Priority
+
+logger = logging.getLogger("handlers")
+
+ALBUM_WINDOW = 1.0  # seconds to wait for the rest of an album
+_album_tasks = set()
+_failed = object()  # album photo that could not be checked for duplicates
 
 
 def register(dp: aiogram.Dispatcher):
@@ -21,12 +28,13 @@ def register(dp: aiogram.Dispatcher):
 
 
 async def view_count(message: Message):
-    async with aiohttp.ClientSession() as session:
-        total = await api.get_player_cards(session, None)
-        player_card = await api.get_player_cards(session, message.chat.id)
-        # for i in player_card['cards']:
-        #     await api.delete_player_card(session, i, message.chat.id)
-    await message.reply(f"Загальні - {len(total['cards'])}\nДодаткові - {len(player_card['cards'])}")
+    total = await api.get_player_cards(None)
+    player_card = await api.get_player_cards(message.chat.id)
+    # for i in player_card['cards']:
+    #     await api.delete_player_card(i, message.chat.id)
+    await scheduler.call(message.chat.id, message.reply,
+                         f"Загальні - {len(total['cards'])}\nДодаткові - {len(player_card['cards'])}",
+                         priority=Priority.INTERACTIVE)
 
 
 async def general(message: Message):
@@ -37,9 +45,23 @@ async def general(message: Message):
         # start_time = time.time()
         # if not os.path.exists(path):
         #     await photo.download(destination_file=f"photos/{photo.file_unique_id}.jpeg")
-        async with aiohttp.ClientSession() as session:
-            result = await api.add_card(session, photo.file_id, message.chat.id)
-        print(photo.file_unique_id, photo.file_id, result, sep=', ')
+        if message.media_group_id:
+            await add_album_photo(message, photo)
+            return
+        duplicate, value_hash = await find_duplicate(message)
+        if duplicate:
+            await scheduler.call(message.chat.id, message.reply, "Ця картка вже є 🙃",
+                                 priority=Priority.INTERACTIVE)
+            return
+
+        # indexed before the call, so a second copy sent meanwhile is caught too
+        await card_index.add(message.chat.id, photo.file_unique_id, value_hash, photo.file_id)
+        try:
+            result = await api.add_card(photo.file_id, message.chat.id)
+        except Exception:  # timeouts and connection errors too, or the photo would stay a "duplicate" forever
+            await card_index.remove(message.chat.id, photo.file_unique_id)
+            raise
+        logger.info("add_card %s, %s, %s", photo.file_unique_id, photo.file_id, result)
         # if message.media_group_id:
         #     general.groups[message.media_group_id].append(path)
         #     await ChatActions.upload_photo(1.5)
@@ -64,4 +86,95 @@ async def general(message: Message):
         #
         #     await message.answer_photo(InputFile(x))
 
-general.groups = defaultdict(list)
+general.groups = {}  # media_group_id -> Album
+
+
+async def find_duplicate(message: Message):
+    """ (file_id of a copy already in the sender's deck or None, dHash of the photo) """
+    photo: PhotoSize = message.photo[-1]
+    if duplicate := await card_index.find(message.chat.id, photo.file_unique_id):
+        return duplicate, None
+    # the smallest size is plenty for a 9x8 hash
+    thumbnail = await message.bot.download_file_by_id(message.photo[0].file_id)
+    value_hash = await asyncio.get_running_loop().run_in_executor(None, dhash, thumbnail.getvalue())
+    return await card_index.find(message.chat.id, photo.file_unique_id, value_hash), value_hash
+
+
+class Album:
+    """ Photos of one media group, a slot per photo resolves to it, None for a duplicate or an error """
+    __slots__ = ('slots', 'deadline')
+
+    def __init__(self):
+        self.slots: list[asyncio.Future] = []
+        self.deadline = 0.0
+
+    def touch(self, *_):
+        self.deadline = asyncio.get_running_loop().time() + ALBUM_WINDOW
+
+
+async def add_album_photo(message: Message, photo: PhotoSize):
+    """
+    Telegram sends every album photo as its own update, collect them and add in one call.
+    The photo joins before it is hashed and the window restarts when it is done,
+    updates of one chat are processed one after another and a long album may take a while
+    """
+    if (album := general.groups.get(message.media_group_id)) is None:
+        album = general.groups[message.media_group_id] = Album()
+        # flush in background, this handler returns before the rest of the album arrives
+        task = asyncio.ensure_future(_add_album(message, album))
+        _album_tasks.add(task)
+        task.add_done_callback(_album_done)
+    slot = asyncio.get_running_loop().create_future()
+    slot.add_done_callback(album.touch)
+    album.slots.append(slot)
+    album.touch()
+    try:
+        duplicate, value_hash = await find_duplicate(message)
+        if not duplicate:
+            await card_index.add(message.chat.id, photo.file_unique_id, value_hash, photo.file_id)
+        slot.set_result(None if duplicate else photo)
+    except Exception as e:  # counted as failed in the album's reply
+        logger.warning("Album %s photo %s: %r", message.media_group_id, photo.file_unique_id, e)
+        slot.set_exception(e)
+    finally:
+        if not slot.done():  # cancelled
+            slot.cancel()
+
+
+def _album_done(task: asyncio.Task):
+    _album_tasks.discard(task)
+    if not task.cancelled() and (error := task.exception()):
+        logger.error("Album upload failed: %r", error)
+
+
+async def _add_album(message: Message, album: Album):
+    loop = asyncio.get_running_loop()
+    while True:  # every photo is hashed and none came for ALBUM_WINDOW
+        if pending := [slot for slot in album.slots if not slot.done()]:
+            await asyncio.wait(pending)
+        elif (delay := album.deadline - loop.time()) > 0:
+            await asyncio.sleep(delay)
+        else:
+            break
+    del general.groups[message.media_group_id]
+    photos = [slot.result() if not slot.cancelled() and not slot.exception() else _failed for slot in album.slots]
+    unique_ids = {photo.file_id: photo.file_unique_id for photo in photos if photo and photo is not _failed}
+    broken = sum(photo is _failed for photo in photos)
+    duplicates = sum(photo is None for photo in photos)
+    try:
+        results = await api.add_cards(list(unique_ids), message.chat.id) if unique_ids else {}
+    except Exception as e:
+        logger.warning("add_cards album %s failed: %r", message.media_group_id, e)
+        results = {card_id: None for card_id in unique_ids}
+    failed = [card_id for card_id, result in results.items() if result is None or isinstance(result, BaseException)]
+    for card_id in failed:
+        await card_index.remove(message.chat.id, unique_ids[card_id])
+    logger.info(f"add_cards album {message.media_group_id}: {len(results) - len(failed)} added, "
+                f"{len(failed) + broken} failed, {duplicates} duplicates")
+
+    text = f"Додано карток: {len(results) - len(failed)}"
+    if failed or broken:
+        text += f"\nНе вдалося додати: {len(failed) + broken}"
+    if duplicates:
+        text += f"\nВже є в колоді: {duplicates}"
+    await scheduler.call(message.chat.id, message.reply, text)
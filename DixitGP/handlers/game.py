@@ -2,10 +2,11 @@ import asyncio
 import enum
 import io
 import logging
+import sys
+import time
+import zlib
 
 import aiogram
-import aiohttp
-from PIL import Image
 from aiogram import Bot
 from aiogram.utils.callback_data import CallbackData
 
@@ -13,12 +14,37 @@ from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import StatesGroup, State
 from aiogram.types import Message, CallbackQuery, ChatActions, InputMediaPhoto, InputFile
 from aiogram.types import InlineKeyboardMarkup as Markup, InlineKeyboardButton as Button
+from aiogram.utils.exceptions import TelegramAPIError, WrongFileIdentifier, WrongRemoteFileIdSpecified
 from api import api
-from utils import watermark
+from logger import benchmark
+from utils.cache import TTLCache
+from utils.card_images import card_images
+from utils.file_ids import file_ids
+from utils.render import renderer
+from utils.scheduler import scheduler, Priority
+from storage import Store, store
+from utils.actors import Actors, detached
+from utils.timer_wheel import TimerWheel
 
 logger = logging.getLogger("handlers")
 game_callbacks = CallbackData('game', 'type', 'args')
 
+LOBBY_DEBOUNCE = 0.3
+LOBBY_EDIT_CONCURRENCY = 8
+MENTION_TTL = 10 * 60
+MENTION_NEGATIVE_TTL = 30
+GAME_IDLE_TTL = 6 * 60 * 60
+GAME_EXPIRE_TICK = 60
+PRERENDER_CACHE_SIZE = 256  # encoded cards, ~200KB each at send resolution
+PRERENDER_TTL = 15 * 60
+PRERENDER_CONCURRENCY = 2  # speculative renders at once, always fewer than the render workers
+PRERENDER_QUEUE = 64  # speculative renders running or waiting for a slot, further guesses are dropped
+
+mentions = TTLCache(maxsize=10_000, ttl=MENTION_TTL)  # chat id -> mention, shared across games
+_mention_requests = {}  # chat id -> in-flight get_chat
+prerendered = TTLCache(maxsize=PRERENDER_CACHE_SIZE, ttl=PRERENDER_TTL)  # (card file id, label) -> render task
+_missing = object()
+
 
 class GameState(enum.Enum):
     Lobby = enum.auto()
@@ -28,10 +54,13 @@ class GameState(enum.Enum):
 
 
 class Game:
+    __slots__ = ('code', 'state', 'players', 'last_activity')
+
     def __init__(self, code):
         self.code = code
         self.state = GameState.Lobby
         self.players = set()
+        self.last_activity = time.time()
 
     def add_player(self, player):
         self.players.add(player)
@@ -40,48 +69,336 @@ class Game:
         if player in self.players:
             self.players.remove(player)
 
+    def to_dict(self):
+        """ Players are not here, they are the members:<code> set """
+        return {"state": self.state.name, "last_activity": self.last_activity}
+
+    @classmethod
+    def from_dict(cls, code, data, players=()):
+        game = cls(code)
+        game.state = GameState[data['state']]
+        game.players = set(players)
+        game.last_activity = data['last_activity']
+        return game
+
+
+class PlayerRecord:
+    """ What the engine remembers about a player instead of the whole aiogram Message """
+    __slots__ = ('chat_id', 'message_id', 'code', 'last_activity', 'rendered')
+
+    def __init__(self, chat_id, message_id, code):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.code = code
+        self.last_activity = time.time()
+        self.rendered = None  # crc32 of the lobby text and markup the message currently shows
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls(data['chat_id'], data['message_id'], data['code'])
+        record.last_activity = data['last_activity']
+        record.rendered = data['rendered']
+        return record
+
 
 class DixitState(StatesGroup):
     waiting_for_riddle = State()
 
 
 class DixitEngine:
-    def __init__(self):
-        self.players = {}
-        self.games = {}
-        self.messages = {}
+    """
+    Games and players live in `store` (shared by all bot processes) as game:<code>, player:<id> and the
+    members:<code> set, joins and leaves of different processes merge in the set instead of overwriting each other.
+    `games` and `players` are this process' copy, refreshed with `refresh_game` / `fetch_code`.
+    """
+
+    def __init__(self, store: Store | None = None, idle_ttl=GAME_IDLE_TTL, expire_tick=GAME_EXPIRE_TICK):
+        self.store = store
+        self.players: dict[int, PlayerRecord] = {}
+        self.games: dict[str, Game] = {}
+        self.idle_ttl = idle_ttl
+        self._expiry = TimerWheel(expire_tick)
+        self._expire_task: asyncio.Task | None = None
+        self._lobby_refreshes = {}  # code -> pending refresh
+        self.actors = Actors(keep=lambda code: code in self.games)  # per game mailboxes, see `run`
+        self.hands: dict[str, dict[int, list]] = {}  # code -> hands sent this round, for `speculate`
+        self._speculated: dict[str, dict] = {}  # code -> {prerendered key: render task} for the next round
+        self._speculating: set[asyncio.Task] = set()  # unfinished speculative renders, see PRERENDER_QUEUE
+        self._speculation_slots: asyncio.Semaphore | None = None
+        self.prerender_hits = 0
+        self.prerender_misses = 0
+
+    async def run(self, code, func, *args, **kwargs):
+        """ Run `func` after everything already submitted for this game, other games are not blocked """
+        return await self.actors.run(code, func, *args, **kwargs)
+
+    def _save_game(self, code):
+        if self.store is not None:
+            game = self.games.get(code)
+            self.store.set(f"game:{code}", game.to_dict() if game else None)
+
+    def _save_member(self, code, player, present):
+        if self.store is not None:
+            (self.store.add_member if present else self.store.remove_member)(f"members:{code}", player)
+
+    def _save_player(self, player):
+        if self.store is not None:
+            record = self.players.get(player)
+            self.store.set(f"player:{player}", record.to_dict() if record else None)
+
+    def _track(self, game):
+        if game.code not in self.games:
+            self._expiry.schedule(game.code, self.idle_ttl)
+            self._start_expiry()
+        self.games[game.code] = game
+
+    async def load(self):
+        """ Pick up games that are already in the store, so abandoned ones still expire """
+        if self.store is None:
+            return
+        codes = [key.split(':', 1)[1] for key in await self.store.scan("game:")]
+        games = await self.store.get_many([f"game:{code}" for code in codes])
+        for code in codes:
+            if data := games.get(f"game:{code}"):
+                self._track(Game.from_dict(code, data, await self.store.members(f"members:{code}")))
+        logger.info(f"DixitEngine.load {len(self.games)} games")
+
+    async def refresh_game(self, code):
+        """ Reload game `code` and its players from the store, None if there is no such game """
+        if self.store is None or code is None:
+            return self.games.get(code)
+        data = await self.store.get(f"game:{code}")
+        players = await self.store.members(f"members:{code}")
+        if not data and not players:
+            if game := self.games.pop(code, None):
+                self.actors.forget(code)
+                for player in game.players:
+                    if (record := self.players.get(player)) and record.code == code:
+                        del self.players[player]
+            return None
+        if data:
+            game = Game.from_dict(code, data, players)
+        else:  # the last player left in another process while someone joined here
+            game = Game(code)
+            game.players = players
+        self._track(game)
+        if not data:
+            self._save_game(code)
+        records = await self.store.get_many([f"player:{player}" for player in game.players])
+        for player in game.players:
+            if record := records.get(f"player:{player}"):
+                self.players[player] = PlayerRecord.from_dict(record)
+        return game
+
+    async def fetch_code(self, player):
+        """ `get_code` that first looks at the store, other processes may have changed it """
+        if self.store is not None:
+            if data := await self.store.get(f"player:{player}"):
+                self.players[player] = PlayerRecord.from_dict(data)
+                await self.refresh_game(data['code'])
+            else:
+                self.players.pop(player, None)
+        return self.get_code(player)
 
     def add(self, code, player, message):
-        logger.info(f"DixitEngine.add {locals()}")
+        logger.info("DixitEngine.add code=%r player=%r message=%s", code, player, message.message_id)
         if not (game := self.games.get(code)):
             game = Game(code)
-            self.games[code] = game
+            self._track(game)
         game.add_player(player)
+        self._save_member(code, player, True)
 
-        self.players[player] = code
-        self.messages[player] = message
+        if (record := self.players.get(player)) and record.code != code:
+            self.remove(record.code, player)
+        self.players[player] = PlayerRecord(message.chat.id, message.message_id, code)
+        self.touch(code, player)
 
     def remove(self, code, player):
-        logger.info(f"DixitEngine.remove {locals()}")
+        logger.info("DixitEngine.remove code=%r player=%r", code, player)
         if game := self.games.get(code):
             game.remove_player(player)
+            self._save_member(code, player, False)
+            game.last_activity = time.time()
             if not game.players:
                 self.games.pop(code)
+                self._expiry.cancel(code)
+                self.actors.forget(code)
+            self._save_game(code)
 
         self.players.pop(player, None)
-        self.messages.pop(player, None)
+        self._save_player(player)
+
+    def touch(self, code, player=None):
+        now = time.time()
+        if game := self.games.get(code):
+            game.last_activity = now
+            self._save_game(code)
+        if record := self.players.get(player):
+            record.last_activity = now
+            self._save_player(player)
 
     def get_code(self, player):
-        return self.players.get(player, None)
+        if record := self.players.get(player):
+            return record.code
+        return None
 
     def get_message_id(self, player):
-        return self.messages.get(player, None)
+        if record := self.players.get(player):
+            return record.message_id
+        return None
+
+    def _start_expiry(self):
+        if self._expire_task is None or self._expire_task.done():
+            self._expire_task = detached(self._expire_loop())
+
+    async def _expire_loop(self):
+        while self.games:
+            await asyncio.sleep(self._expiry.tick)
+            for code in self._expiry.advance():
+                if not (game := await self.refresh_game(code)):
+                    continue
+                if (idle := time.time() - game.last_activity) >= self.idle_ttl:
+                    self.evict(code)
+                else:
+                    self._expiry.schedule(code, self.idle_ttl - idle)
+
+    def evict(self, code):
+        if not (game := self.games.pop(code, None)):
+            return
+        logger.info(f"DixitEngine.evict idle game {code}, players {len(game.players)}")
+        self._expiry.cancel(code)
+        self.actors.forget(code)
+        self.discard_speculation(code)
+        self.hands.pop(code, None)
+        self._save_game(code)
+        for player in game.players:
+            self._save_member(code, player, False)
+            if (record := self.players.get(player)) and record.code == code:
+                del self.players[player]
+                self._save_player(player)
+
+    def memory_usage(self, code):
+        """ Approximate bytes held by the engine for one game """
+        if not (game := self.games.get(code)):
+            return 0
+        size = sys.getsizeof(game) + sys.getsizeof(game.players) + sys.getsizeof(code)
+        for player in game.players:
+            size += sys.getsizeof(player)
+            if record := self.players.get(player):
+                size += sys.getsizeof(record)
+        return size
+
+    def stats(self):
+        sizes = [self.memory_usage(code) for code in self.games]
+        return {
+            "games": len(self.games),
+            "players": len(self.players),
+            "scheduled": len(self._expiry),
+            "bytes": sum(sizes),
+            "bytes_per_game": sum(sizes) / len(sizes) if sizes else 0,
+            "prerendered": len(prerendered),
+            "speculating": len(self._speculating),
+            "prerender_hits": self.prerender_hits,
+            "prerender_misses": self.prerender_misses,
+        }
+
+    def speculate(self, code, hands=None, played=None):
+        """
+        Render in background the cards players will probably hold next round, while they think.
+        `hands` - {player: hand} just sent, `played` - {player: index} of cards already known to leave the hand.
+        Guesses assume the hand keeps its order, whatever does not match is discarded by `discard_speculation`.
+        """
+        if hands is not None:
+            self.hands[code] = hands
+        if not (hands := self.hands.get(code)) or renderer.workers < 2:  # one worker has no room to spare
+            return
+        keys = set()
+        for player, hand in hands.items():
+            if played and player in played:
+                hand = hand[:played[player]] + hand[played[player] + 1:]
+                keys.update((file, label) for label, file in enumerate(hand, 1))
+            else:  # one card leaves, the rest keep their label or move one to the left
+                for label, file in enumerate(hand, 1):
+                    keys.update((file, i) for i in (label, label - 1) if i)
+
+        bot = Bot.get_current()
+        speculated = self._speculated.setdefault(code, {})
+        for key in keys:
+            if key in speculated or key in prerendered:
+                continue
+            if len(self._speculating) >= PRERENDER_QUEUE:
+                logger.debug("Speculation queue is full, game %s skips the rest of its cards", code)
+                break
+            task = detached(self._prerender(bot, *key))
+            task.add_done_callback(self._speculation_done)
+            self._speculating.add(task)
+            prerendered.set(key, task)
+            speculated[key] = task
+
+    def _speculation_done(self, task):
+        self._speculating.discard(task)
+        if not task.cancelled():
+            task.exception()  # retrieved here, `take_prerendered` logs it
+
+    async def _prerender(self, bot, file, label):
+        if await file_ids.get(file, label) is not None:
+            return None  # already uploaded, nothing to render
+        if self._speculation_slots is None:
+            self._speculation_slots = asyncio.Semaphore(min(PRERENDER_CONCURRENCY, renderer.workers - 1))
+        async with self._speculation_slots:
+            return await render_hand_card(bot, file, label, background=True)
+
+    async def take_prerendered(self, bot, file, label):
+        """ Encoded card from the speculative cache if it was guessed right, rendered now otherwise """
+        if (task := prerendered.pop((file, label))) is not None and not task.cancelled():
+            try:
+                data = await task
+            except Exception as e:
+                logger.warning("Speculative render of %s failed: %r", file, e)
+            else:
+                if data is not None:
+                    self.prerender_hits += 1
+                    return data
+        self.prerender_misses += 1
+        return await render_hand_card(bot, file, label)
+
+    def discard_speculation(self, code):
+        """ Drop guesses for the round that did not come true and cancel their renders, unless already taken """
+        for key, task in self._speculated.pop(code, {}).items():
+            if prerendered.pop(key) is task:
+                task.cancel()
+
+    async def _edit(self, player, text, reply_markup=None):
+        record = self.players[player]
+        bot = Bot.get_current()
+        message = await scheduler.call(
+            record.chat_id, bot.edit_message_text, text, record.chat_id, record.message_id,
+            reply_markup=reply_markup, priority=Priority.INTERACTIVE)
+        record.message_id = message.message_id
+        self._save_player(player)
 
     async def update_game_lobby(self, code):
-        if not de.games.get(code):
+        """ Refreshes within LOBBY_DEBOUNCE of each other are merged into one """
+        if (refresh := self._lobby_refreshes.get(code)) is None:
+            refresh = detached(self._refresh_lobby(code))
+            self._lobby_refreshes[code] = refresh
+        await asyncio.shield(refresh)
+
+    async def _refresh_lobby(self, code):
+        await asyncio.sleep(LOBBY_DEBOUNCE)
+        # changes from now on need a new refresh, this one may have fetched too early
+        self._lobby_refreshes.pop(code, None)
+        await self.run(code, self._render_lobby, code)
+
+    @benchmark('render_lobby')
+    async def _render_lobby(self, code):
+        if not await self.refresh_game(code):
             return
-        async with aiohttp.ClientSession() as session:
-            info = await api.get_lobby_info(session, code)
+        self.touch(code)
+        info = await api.get_lobby_info(code)
 
         text = f'Код гри {code}\n\n'
         mentions = await get_users_mention(*[p['player_id'] for p in info['players']])
@@ -90,8 +407,11 @@ class DixitEngine:
         text += "\n".join(players)
 
         from .start import start_callbacks
-        for player_id, player in {i['player_id']: i for i in info['players']}.items():
-            player_message = self.messages[player_id]
+        semaphore = asyncio.Semaphore(LOBBY_EDIT_CONCURRENCY)
+
+        async def _edit(player_id, player):
+            if not (record := self.players.get(player_id)):
+                return
             markup = Markup(row_width=1)
             if player['role'] == 'admin':
                 markup.add(
@@ -100,80 +420,152 @@ class DixitEngine:
             markup.add(
                 Button("Покинути гру", callback_data=start_callbacks.new(type='leave')),
             )
-            self.messages[player_id] = await player_message.edit_text(text, reply_markup=markup)
+            rendered = zlib.crc32(f"{text}{markup.as_json()}".encode())
+            if record.rendered == rendered:
+                return
+            async with semaphore:
+                await self._edit(player_id, text, reply_markup=markup)
+            if record := self.players.get(player_id):
+                record.rendered = rendered
+                self._save_player(player_id)
+
+        players = {i['player_id']: i for i in info['players']}
+        tasks = [_edit(player_id, player) for player_id, player in players.items()]
+        results = await asyncio.gather(*(asyncio.ensure_future(i) for i in tasks), return_exceptions=True)
+        # a blocked bot or a deleted message must not keep the other players' lobbies stale
+        for player_id, result in zip(players, results):
+            if isinstance(result, Exception):
+                logger.warning("Lobby edit of %s for player %s failed: %r", code, player_id, result)
+            elif isinstance(result, BaseException):
+                raise result
 
     async def update_game_info(self, code):
-        # bot = Bot.get_current()
-        async with aiohttp.ClientSession() as session:
-            info = (await api.get_game_info(session, code))['game_info']
+        await self.refresh_game(code)
+        info = (await api.get_game_info(code))['game_info']
         text = f"Очків для перемоги: {info['win_score']}\n\n"
+        self.touch(code)
 
         for player_id in self.games[code].players:
-            await self.messages[player_id].edit_text(text, reply_markup=None)
+            self.players[player_id].rendered = None
+            await self._edit(player_id, text, reply_markup=None)
 
 
+@benchmark('render_hand_card')
+async def render_hand_card(bot, file, label, background=False) -> bytes:
+    # the source is released as soon as its card is rendered, not when the whole hand is
+    image = await card_images.open(bot, file)
+    try:
+        return await renderer.render(image, label, background)
+    finally:
+        image.close()
+
+
+@benchmark('send_players_hands')
 async def send_players_hands(code):
     bot = Bot.get_current()
-    async with aiohttp.ClientSession() as session:
-        info = (await api.get_game_info(session, code))['game_info']
-        author_id = info['author']['player_id']
-        player_ids = [i['player_id'] for i in info['players']]
-
-        hands_tasks = [
-            api.get_hand(session, code, author_id),
-            *[api.get_hand(session, code, i) for i in player_ids],
-        ]
-        author_hand, *players_hands = await asyncio.gather(*(asyncio.ensure_future(i) for i in hands_tasks))
-
-    tasks = [bot.send_chat_action(i, ChatActions.UPLOAD_PHOTO) for i in [author_id, *player_ids]]
-    await asyncio.gather(*(asyncio.ensure_future(i) for i in tasks))
+    info = (await api.get_game_info(code))['game_info']
+    author_id = info['author']['player_id']
+    player_ids = [i['player_id'] for i in info['players']]
 
-    async def _send_media_hand(player_id, hand):
-        files = []
-        tasks = [bot.download_file_by_id(file) for file in hand]
-        files_image = await asyncio.gather(*(asyncio.ensure_future(i) for i in tasks))
+    hands = await api.get_hands(code, [author_id, *player_ids])
+    author_hand, players_hands = hands[author_id], [hands[i] for i in player_ids]
 
-        for i, file in enumerate(files_image, start=1):
-            image = Image.open(file)
-            image = watermark.get_marked_image(image, i)
-            x = io.BytesIO()
-            image.save(x, format="jpeg")
-            x.seek(0)
-            files.append(InputMediaPhoto(InputFile(x)))
-        await bot.send_media_group(player_id, files, protect_content=True)
+    tasks = [scheduler.call(i, bot.send_chat_action, i, ChatActions.UPLOAD_PHOTO) for i in [author_id, *player_ids]]
+    await asyncio.gather(*(asyncio.ensure_future(i) for i in tasks))
+
+    async def _send_media_hand(player_id, hand, use_cache=True):
+        labels = range(1, len(hand) + 1)
+        cached = await file_ids.get_many(zip(hand, labels)) if use_cache else [None] * len(hand)
+        missing = [(file, i) for file, i, file_id in zip(hand, labels, cached) if file_id is None]
+
+        tasks = [de.take_prerendered(bot, file, i) for file, i in missing]
+        rendered = iter(await asyncio.gather(*(asyncio.ensure_future(i) for i in tasks)))
+        rendered = [None if file_id else next(rendered) for file_id in cached]
+
+        async def _send():
+            files = [InputMediaPhoto(file_id or InputFile(io.BytesIO(data)))
+                     for file_id, data in zip(cached, rendered)]
+            return await bot.send_media_group(player_id, files, protect_content=True)
+
+        try:
+            messages = await scheduler.call(player_id, _send, priority=Priority.BULK)
+        except (WrongFileIdentifier, WrongRemoteFileIdSpecified) as e:
+            if not use_cache or not any(cached):
+                raise
+            rendered.clear()
+            logger.warning("Cached file ids rejected for %s, rendering again: %r", player_id, e)
+            for file, i in zip(hand, labels):
+                await file_ids.delete(file, i)
+            return await _send_media_hand(player_id, hand, use_cache=False)
+        rendered.clear()  # uploaded, the encoded cards are not needed while the rest of the hands are sent
+
+        for file, i, file_id, sent in zip(hand, labels, cached, messages):
+            if file_id is None:
+                await file_ids.put(file, i, sent.photo[-1].file_id)
 
     tasks = [
         _send_media_hand(author_id, author_hand['hand']),
         *[_send_media_hand(id_, h['hand']) for id_, h in zip(player_ids, players_hands)],
     ]
     await asyncio.gather(*(asyncio.ensure_future(i) for i in tasks))
+    de.discard_speculation(code)
+    de.speculate(code, {author_id: author_hand['hand'], **{i: h['hand'] for i, h in zip(player_ids, players_hands)}})
     markup = Markup()
     count = len(author_hand['hand'])
     markup.add(*[Button(f"{i + 1}", callback_data=game_callbacks.new(type='riddle', args=f"{i}_{count}"))
                  for i in range(count)])
-    await bot.send_message(author_id, "Оберіть одну з карток 👆", reply_markup=markup)
+    await scheduler.call(author_id, bot.send_message, author_id, "Оберіть одну з карток 👆", reply_markup=markup)
+
+
+async def _fetch_mention(bot, chat_id):
+    try:
+        chat = await scheduler.call(None, bot.get_chat, chat_id, priority=Priority.INTERACTIVE)
+    except TelegramAPIError as e:
+        logger.warning("get_chat %s failed: %r", chat_id, e)
+        mentions.set(chat_id, str(chat_id), ttl=MENTION_NEGATIVE_TTL)
+        return str(chat_id)
+    mentions.set(chat_id, chat.mention)
+    return chat.mention
 
 
 async def get_users_mention(*chat_ids):
     bot = Bot.get_current()
-    tasks = [bot.get_chat(chat_id) for chat_id in chat_ids]
-    result = await asyncio.gather(*(asyncio.ensure_future(i) for i in tasks))
-    return [chat.mention for chat in result]
+    result, requests = {}, {}
+    for chat_id in dict.fromkeys(chat_ids):
+        if (mention := mentions.get(chat_id, _missing)) is not _missing:
+            result[chat_id] = mention
+            continue
+        if (request := _mention_requests.get(chat_id)) is None:
+            request = detached(_fetch_mention(bot, chat_id))
+            request.add_done_callback(lambda _, chat_id=chat_id: _mention_requests.pop(chat_id, None))
+            _mention_requests[chat_id] = request
+        requests[chat_id] = request
+
+    for chat_id, request in requests.items():
+        result[chat_id] = await asyncio.shield(request)
+    return [result[chat_id] for chat_id in chat_ids]
+
+
+def prefetch_mentions(*chat_ids):
+    """ Warm the mentions cache in background, e.g. while the lobby is being fetched """
+    task = detached(get_users_mention(*chat_ids))
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
 
 
 async def riddle_card(call: CallbackQuery, callback_data):
     user_id = call.message.chat.id
-    code = de.get_code(user_id)
+    code = await de.fetch_code(user_id)
     card, count, *_ = callback_data.get("args").split('_')
-    logger.info(f"riddle_card by user {user_id}, {code}")
-    # async with aiohttp.ClientSession() as session:
-    #     result = await api.leave_game(session, code, user_id)
+    logger.info("riddle_card by user %s, %s", user_id, code)
+    de.touch(code, user_id)
+    de.speculate(code, played={user_id: int(card)})
+    # result = await api.leave_game(code, user_id)
     #
     # de.remove(code, user_id)
     # await de.update_game_lobby(code)
     # await call.message.edit_text("Ви залишили гру", reply_markup=None)
     await DixitState.waiting_for_riddle.set()
-    await call.answer()
+    await scheduler.call(None, call.answer, priority=Priority.INTERACTIVE)
 
 
 def register(dp: aiogram.Dispatcher):
@@ -186,4 +578,4 @@ def register(dp: aiogram.Dispatcher):
     pass
 
 
-de = DixitEngine()
+de = DixitEngine(store)
@@ -1,7 +1,6 @@
 import logging
 
 import aiogram
-import aiohttp
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import StatesGroup, State
 from aiogram.types import InlineKeyboardMarkup as Markup, InlineKeyboardButton as Button
@@ -9,7 +8,8 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.utils.callback_data import CallbackData
 
 from api import api, APIError
-from .game import de, send_players_hands
+from utils.scheduler import scheduler, Priority
+from .game import de, send_players_hands, prefetch_mentions
 
 logger = logging.getLogger("handlers")
 start_callbacks = CallbackData('start', 'type')
@@ -22,8 +22,8 @@ class ConnectingState(StatesGroup):
 async def start(message: Message, state: FSMContext):
     await state.reset_state(with_data=False)
     user_id = message.chat.id
-    if code := de.get_code(user_id):
-        await message.answer(f"Ви вже в грі {code!r}")
+    if code := await de.fetch_code(user_id):
+        await scheduler.call(user_id, message.answer, f"Ви вже в грі {code!r}", priority=Priority.INTERACTIVE)
         return
     text = "Вітаю, обери дію 😌"
     markup = Markup(row_width=1)
@@ -31,57 +31,72 @@ async def start(message: Message, state: FSMContext):
         Button("Створити гру", callback_data=start_callbacks.new(type='create')),
         Button("Приеднатись до гри", callback_data=start_callbacks.new(type='connect')),
     )
-    await message.answer(text, reply_markup=markup)
+    await scheduler.call(user_id, message.answer, text, reply_markup=markup, priority=Priority.INTERACTIVE)
     # await send_players_hands("26F8F5")
 
 
 async def create_game(call: CallbackQuery):
     admin_id = call.message.chat.id
-    logger.info(f"create_game by user {admin_id}")
-    async with aiohttp.ClientSession() as session:
-        try:
-            result = await api.create_game(session, admin_id)
-            code = result['code']
-        except APIError as e:
-            logger.error("Unexpected error: {!r}".format(e))
-            return
-    await call.message.edit_text(call.message.text, reply_markup=None)
-
-    m = await call.message.answer("Завантаження.. ⏳")
-    de.add(code, admin_id, m)
+    logger.info("create_game by user %s", admin_id)
+    try:
+        result = await api.create_game(admin_id)
+        code = result['code']
+    except APIError as e:
+        logger.error("Unexpected error: {!r}".format(e))
+        return
+    await scheduler.call(admin_id, call.message.edit_text, call.message.text, reply_markup=None,
+                         priority=Priority.INTERACTIVE)
+
+    m = await scheduler.call(admin_id, call.message.answer, "Завантаження.. ⏳", priority=Priority.INTERACTIVE)
+
+    async def _add():
+        de.add(code, admin_id, m)
+
+    await de.run(code, _add)
+    prefetch_mentions(admin_id)
     await de.update_game_lobby(code)
-    await call.answer()
+    await scheduler.call(None, call.answer, priority=Priority.INTERACTIVE)
 
 
 async def connect_game(call: CallbackQuery):
     user_id = call.message.chat.id
-    logger.info(f"connect_game by user {user_id}")
+    logger.info("connect_game by user %s", user_id)
     await ConnectingState.waiting_for_game_code.set()
-    await call.message.edit_text("Надішліть код гри", reply_markup=None)
-    await call.answer()
+    await scheduler.call(user_id, call.message.edit_text, "Надішліть код гри", reply_markup=None,
+                         priority=Priority.INTERACTIVE)
+    await scheduler.call(None, call.answer, priority=Priority.INTERACTIVE)
+
+
+async def _connect(message: Message, code):
+    user_id = message.chat.id
+    try:
+        result = await api.connect_to_game(code, user_id)
+    except APIError as e:
+        result = e.args[0]
+        if "no game" in result['error_message'].lower():
+            await scheduler.call(user_id, message.reply, "Гру не знайдено",
+                                 priority=Priority.INTERACTIVE)
+            return False
+        if "player already exists" in result['error_message'].lower():
+            await scheduler.call(user_id, message.answer, "Ви вже у грі", priority=Priority.INTERACTIVE)
+            # todo: send some lobby info
+            return False
+        logger.error("Unexpected error: {!r}".format(e))
+        return False
+
+    m = await scheduler.call(user_id, message.answer, "Завантаження.. ⏳", priority=Priority.INTERACTIVE)
+    await de.refresh_game(code)
+    de.add(code, user_id, m)
+    return True
 
 
 async def connect_game_by_code(message: Message, state: FSMContext):
     user_id = message.chat.id
     code = str(message.text).upper()
-    logger.info(f"connect_game_by_code by user {user_id}, {code}")
-    async with aiohttp.ClientSession() as session:
-        try:
-            result = await api.connect_to_game(session, code, user_id)
-        except APIError as e:
-            result = e.args[0]
-            if "no game" in result['error_message'].lower():
-                await message.reply("Гру не знайдено")
-                return
-            if "player already exists" in result['error_message'].lower():
-                await message.answer("Ви вже у грі")
-                # todo: send some lobby info
-                return
-            logger.error("Unexpected error: {!r}".format(e))
-            return
-
-    m = await message.answer("Завантаження.. ⏳")
-    de.add(code, user_id, m)
+    logger.info("connect_game_by_code by user %s, %s", user_id, code)
+    if not await de.run(code, _connect, message, code):
+        return
+    prefetch_mentions(*de.games[code].players)
     await de.update_game_lobby(code)
 
     await state.reset_state(with_data=False)
@@ -89,27 +104,32 @@ async def connect_game_by_code(message: Message, state: FSMContext):
 
 async def leave_game(call: CallbackQuery):
     user_id = call.message.chat.id
-    code = de.get_code(user_id)
-    logger.info(f"leave_game by user {user_id}, {code}")
-    async with aiohttp.ClientSession() as session:
-        result = await api.leave_game(session, code, user_id)
+    code = await de.fetch_code(user_id)
+    logger.info("leave_game by user %s, %s", user_id, code)
 
-    de.remove(code, user_id)
+    async def _leave():
+        result = await api.leave_game(code, user_id)
+        de.remove(code, user_id)
+
+    await de.run(code, _leave)
     await de.update_game_lobby(code)
-    await call.message.edit_text("Ви залишили гру", reply_markup=None)
-    await call.answer()
+    await scheduler.call(user_id, call.message.edit_text, "Ви залишили гру", reply_markup=None,
+                         priority=Priority.INTERACTIVE)
+    await scheduler.call(None, call.answer, priority=Priority.INTERACTIVE)
 
 
 async def start_game(call: CallbackQuery):
     user_id = call.message.chat.id
-    code = de.get_code(user_id)
-    logger.info(f"start_game by user {user_id}, {code}")
-    async with aiohttp.ClientSession() as session:
-        result = await api.start_game(session, code)
-
-    await call.answer()
-    await de.update_game_info(code)
-    await send_players_hands(code)
+    code = await de.fetch_code(user_id)
+    logger.info("start_game by user %s, %s", user_id, code)
+
+    async def _start():
+        result = await api.start_game(code)
+        await scheduler.call(None, call.answer, priority=Priority.INTERACTIVE)
+        await de.update_game_info(code)
+        await send_players_hands(code)
+
+    await de.run(code, _start)
 
 
 def register(dp: aiogram.Dispatcher):
@@ -2,40 +2,43 @@ import asyncio
 import time
 
 import aiogram
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.types import BotCommand
 
 from config_reader import config
-from logger import init_logging
+from logger import init_logging, stop_logging
 
 RECONNECT_TIME = 60
 
 
 async def error_handler(update: aiogram.types.Update, exception):
+    from utils.scheduler import scheduler, Priority
     message = update.message
     if update.callback_query:
-        await update.callback_query.answer("🤨", show_alert=True)
+        await scheduler.call(None, update.callback_query.answer, "🤨", show_alert=True, priority=Priority.INTERACTIVE)
         message = update.callback_query.message
 
-    logger.exception(f"error_handler: {exception!r}. {update}")
-    await update.bot.send_message(738016227, f'{message.chat} fails:\n{exception!r}')
-    await message.reply("🤨")
+    logger.exception("error_handler: %r. %s", exception, update)
+    await scheduler.call(738016227, update.bot.send_message, 738016227, f'{message.chat} fails:\n{exception!r}')
+    await scheduler.call(message.chat.id, message.reply, "🤨", priority=Priority.INTERACTIVE)
     return True
 
 
+COMMANDS = [
+    BotCommand(command="/start", description="Почати вібор гри"),
+    BotCommand(command="/cards", description="Переглянути існуючі картки"),
+]
+
+
 async def set_commands(bot: aiogram.Bot):
-    commands = [
-        BotCommand(command="/start", description="Почати вібор гри"),
-        BotCommand(command="/cards", description="Переглянути існуючі картки"),
-    ]
-    await bot.set_my_commands(commands)
+    await bot.set_my_commands(COMMANDS)
 
 
 def create_dispatcher():
     import handlers
     import administraion
+    from storage import KVStorage, store
     bot = aiogram.Bot(config.BOT_TOKEN.get_secret_value(), parse_mode='HTML')
-    dp = aiogram.Dispatcher(bot, storage=MemoryStorage())
+    dp = aiogram.Dispatcher(bot, storage=KVStorage(store))
     handlers.register(dp)
     administraion.register(dp)
 
@@ -43,22 +46,85 @@ def create_dispatcher():
     return dp
 
 
+async def on_startup(dp: aiogram.Dispatcher, notify_admins=True, metrics_port=config.METRICS_PORT):
+    import administraion
+    from api import api
+    from handlers.game import de
+    from utils import metrics
+    from utils.duplicates import card_index
+    from utils.loop_monitor import loop_monitor
+    loop_monitor.start()
+    await api.start()
+    await de.load()
+    await card_index.load()
+    if metrics_port:
+        await metrics.start_server(config.METRICS_HOST, metrics_port)
+    if notify_admins:
+        await administraion.on_startup(dp)
+
+
+async def on_shutdown(dp: aiogram.Dispatcher):
+    from api import api
+    from storage import store
+    from utils.duplicates import card_index
+    from utils.file_ids import file_ids
+    from utils.render import renderer
+    from utils.scheduler import scheduler
+    from utils import metrics
+    from utils.loop_monitor import loop_monitor
+    await metrics.stop_server()
+    loop_monitor.stop()
+    await api.close()
+    renderer.shutdown()
+    await scheduler.stop()
+    await store.close()
+    await file_ids.close()
+    await card_index.close()
+    await (await dp.bot.get_session()).close()
+
+
 async def _main():
     dp = create_dispatcher()
     logger.info(f"Starting bot... {await dp.bot.get_me()}")
     await set_commands(dp.bot)
-    import administraion
-    await administraion.on_startup(dp)
     try:
+        await on_startup(dp)  # inside, so a failed start is cleaned up before the reconnect
         await dp.start_polling()
     except BaseException as error:
         raise error
     finally:
+        await on_shutdown(dp)
         del dp
 
 
+async def _worker_main(index, updates):
+    import webhook
+    dp = create_dispatcher()
+    logger.info(f"Starting webhook worker {index}")
+    try:
+        await on_startup(dp, notify_admins=index == 0,
+                         metrics_port=config.METRICS_PORT and config.METRICS_PORT + index)
+        await webhook.run_worker(dp, updates)
+    finally:
+        await on_shutdown(dp)
+
+
+def worker(index, updates):
+    try:
+        asyncio.run(_worker_main(index, updates))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_logging()  # forked processes exit without atexit hooks
+
+
 def main():
     # aiogramwrap.wrap_all()
+    if config.MODE == 'webhook':
+        import webhook
+        webhook.serve(worker, COMMANDS)
+        return
+
     while True:
         try:
             asyncio.run(_main())
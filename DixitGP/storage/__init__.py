@@ -0,0 +1,23 @@
+from config_reader import config
+
+from .backends import Backend, MemoryBackend, SQLiteBackend, RedisBackend
+from .fsm import KVStorage
+from .store import Store
+
+
+def create_backend(url: str) -> Backend:
+    """ memory:// | sqlite:///relative/path.sqlite3 | redis://host:port/db """
+    if url.startswith('memory://'):
+        return MemoryBackend()
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisBackend(url)
+    raise ValueError(f"Unknown storage url {url!r}")
+
+
+store = Store(
+    create_backend(config.STORAGE_URL),
+    flush_interval=config.STORAGE_FLUSH_INTERVAL,
+    cache_ttl=config.STORAGE_CACHE_TTL,
+)
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Backend:
+    """ Async key -> JSON value storage shared between bot processes """
+
+    async def get_many(self, keys) -> dict:
+        raise NotImplementedError
+
+    async def set_many(self, items: dict):
+        """ Write all `items` at once, None value deletes the key """
+        raise NotImplementedError
+
+    async def scan(self, prefix) -> list:
+        raise NotImplementedError
+
+    async def members(self, key) -> set:
+        """ Members of set `key`, sets are kept apart from plain values """
+        raise NotImplementedError
+
+    async def update_sets(self, changes: dict):
+        """ {key: {member: True to add, False to remove}}, members of other processes are left alone """
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MemoryBackend(Backend):
+    """ Single process only, for development """
+
+    def __init__(self):
+        self.data = {}
+        self.sets = {}
+
+    async def get_many(self, keys):
+        return {key: json.loads(self.data[key]) for key in keys if key in self.data}
+
+    async def set_many(self, items):
+        for key, value in items.items():
+            if value is None:
+                self.data.pop(key, None)
+            else:
+                self.data[key] = json.dumps(value)
+
+    async def scan(self, prefix):
+        return [key for key in self.data if key.startswith(prefix)]
+
+    async def members(self, key):
+        return {json.loads(member) for member in self.sets.get(key, ())}
+
+    async def update_sets(self, changes):
+        for key, members in changes.items():
+            current = self.sets.setdefault(key, set())
+            for member, present in members.items():
+                (current.add if present else current.discard)(json.dumps(member))
+            if not current:
+                del self.sets[key]
+
+
+class SQLiteBackend(Backend):
+    """ One SQLite file in WAL mode, shared by the processes of one host """
+
+    def __init__(self, path):
+        self.path = path
+        self._db: sqlite3.Connection | None = None
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='sqlite')  # sqlite connection is single threaded
+
+    def _connect(self):
+        if self._db is None:
+            if folder := os.path.dirname(self.path):
+                os.makedirs(folder, exist_ok=True)
+            self._db = sqlite3.connect(self.path, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS sets (key TEXT NOT NULL, member TEXT NOT NULL,"
+                             " PRIMARY KEY (key, member)) WITHOUT ROWID")
+        return self._db
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _get_many(self, keys):
+        db, result = self._connect(), {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = db.execute(f"SELECT key, value FROM kv WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+            result.update((key, json.loads(value)) for key, value in rows)
+        return result
+
+    def _set_many(self, items):
+        db = self._connect()
+        with db:
+            db.executemany(
+                "INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value)) for key, value in items.items() if value is not None],
+            )
+            db.executemany("DELETE FROM kv WHERE key = ?", [(key,) for key, value in items.items() if value is None])
+
+    def _scan(self, prefix):
+        rows = self._connect().execute("SELECT key FROM kv WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+        return [key for key, in rows]
+
+    def _members(self, key):
+        return {json.loads(member) for member, in self._connect().execute(
+            "SELECT member FROM sets WHERE key = ?", (key,))}
+
+    def _update_sets(self, changes):
+        db = self._connect()
+        with db:
+            for key, members in changes.items():
+                db.executemany("INSERT OR IGNORE INTO sets (key, member) VALUES (?, ?)",
+                               [(key, json.dumps(member)) for member, present in members.items() if present])
+                db.executemany("DELETE FROM sets WHERE key = ? AND member = ?",
+                               [(key, json.dumps(member)) for member, present in members.items() if not present])
+
+    async def get_many(self, keys):
+        return await self._run(self._get_many, list(keys))
+
+    async def set_many(self, items):
+        await self._run(self._set_many, dict(items))
+
+    async def scan(self, prefix):
+        return await self._run(self._scan, prefix)
+
+    async def members(self, key):
+        return await self._run(self._members, key)
+
+    async def update_sets(self, changes):
+        await self._run(self._update_sets, {key: dict(members) for key, members in changes.items()})
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+        self._db = None
+
+    async def close(self):
+        await self._run(self._close)
+
+
+class RedisBackend(Backend):
+    """ Needs the optional `redis` package (redis.asyncio) """
+
+    def __init__(self, url):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("Redis storage requires `pip install redis`") from e
+        self._redis = redis.from_url(url)
+
+    async def get_many(self, keys):
+        keys = list(keys)
+        values = await self._redis.mget(keys) if keys else []
+        return {key: json.loads(value) for key, value in zip(keys, values) if value is not None}
+
+    async def set_many(self, items):
+        async with self._redis.pipeline(transaction=True) as pipe:
+            if updates := {key: json.dumps(value) for key, value in items.items() if value is not None}:
+                pipe.mset(updates)
+            if deletes := [key for key, value in items.items() if value is None]:
+                pipe.delete(*deletes)
+            await pipe.execute()
+
+    async def scan(self, prefix):
+        return [key.decode() async for key in self._redis.scan_iter(match=f"{prefix}*")]
+
+    async def members(self, key):
+        return {json.loads(member) for member in await self._redis.smembers(key)}
+
+    async def update_sets(self, changes):
+        async with self._redis.pipeline(transaction=True) as pipe:
+            for key, members in changes.items():
+                if added := [json.dumps(member) for member, present in members.items() if present]:
+                    pipe.sadd(key, *added)
+                if removed := [json.dumps(member) for member, present in members.items() if not present]:
+                    pipe.srem(key, *removed)
+            await pipe.execute()
+
+    async def close(self):
+        await self._redis.close()
@@ -0,0 +1,91 @@
+import typing
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from .store import Store
+
+
+class KVStorage(BaseStorage):
+    """ aiogram FSM storage on top of `Store`, so every bot process sees the same states """
+
+    def __init__(self, store: Store, prefix='fsm'):
+        self.store = store
+        self.prefix = prefix
+
+    def _key(self, chat, user):
+        chat, user = self.check_address(chat=chat, user=user)
+        return f"{self.prefix}:{chat}:{user}"
+
+    async def _get(self, chat, user):
+        return await self.store.get(self._key(chat, user)) or {'state': None, 'data': {}, 'bucket': {}}
+
+    async def _update(self, chat, user, **fields):
+        key = self._key(chat, user)
+        record = await self.store.get(key) or {'state': None, 'data': {}, 'bucket': {}}
+        record.update(fields)
+        empty = record['state'] is None and not record['data'] and not record['bucket']
+        self.store.set(key, None if empty else record)
+
+    async def close(self):
+        await self.store.flush()
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        state = (await self._get(chat, user))['state']
+        return self.resolve_state(default) if state is None else state
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[typing.Dict] = None) -> typing.Dict:
+        return (await self._get(chat, user))['data'] or default or {}
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.Optional[typing.AnyStr] = None):
+        await self._update(chat, user, state=self.resolve_state(state))
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        await self._update(chat, user, data=data or {})
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None,
+                          **kwargs):
+        current = await self.get_data(chat=chat, user=user)
+        current.update(data or {}, **kwargs)
+        await self.set_data(chat=chat, user=user, data=current)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        return (await self._get(chat, user))['bucket'] or default or {}
+
+    async def set_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        await self._update(chat, user, bucket=bucket or {})
+
+    async def update_bucket(self, *,
+                            chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None,
+                            **kwargs):
+        current = await self.get_bucket(chat=chat, user=user)
+        current.update(bucket or {}, **kwargs)
+        await self.set_bucket(chat=chat, user=user, bucket=current)
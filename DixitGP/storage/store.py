@@ -0,0 +1,166 @@
+import asyncio
+import copy
+import logging
+
+from utils.cache import TTLCache
+
+from .backends import Backend
+
+logger = logging.getLogger("storage")
+
+_missing = object()
+RETRY_DELAY = 1.0  # between attempts of a failed flush
+CLOSE_ATTEMPTS = 3  # a batch still failing on close is dropped after these
+
+
+class Store:
+    """
+    Backend with write-behind batching and a short-lived in-process read cache.
+    Writes are visible to this process at once and to other processes after the next flush,
+    reads may see other processes' writes up to `cache_ttl` late.
+    Values are replaced whole, sets (`add_member` / `remove_member`) merge changes from every process.
+    """
+
+    def __init__(self, backend: Backend, flush_interval=0.05, batch_size=256, cache_ttl=1.0, cache_size=10_000):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.member_cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._pending = {}  # key -> value, None to delete
+        self._pending_members = {}  # set key -> {member: True to add, False to remove}
+        self._writing_members = {}  # the same, for changes being written right now
+        self._flush_task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()  # one write at a time, so an older batch never lands after a newer one
+        self._writing = False
+
+    async def get(self, key, default=None):
+        return (await self.get_many([key])).get(key, default)
+
+    async def get_many(self, keys) -> dict:
+        result, missing = {}, []
+        for key in keys:
+            if key in self._pending:
+                value = self._pending[key]
+            elif (value := self.cache.get(key, _missing)) is _missing:
+                missing.append(key)
+                continue
+            if value is not None:
+                result[key] = copy.deepcopy(value)
+
+        if missing:
+            loaded = await self.backend.get_many(missing)
+            for key in missing:
+                value = loaded.get(key)
+                if key not in self._pending:  # written while we were loading
+                    self.cache.set(key, value)
+                if value is not None:
+                    result[key] = copy.deepcopy(value)
+        return result
+
+    def set(self, key, value):
+        """ Queue a write, None deletes the key """
+        value = copy.deepcopy(value)
+        self._pending[key] = value
+        self.cache.set(key, value)
+        self._queued()
+
+    def delete(self, key):
+        self.set(key, None)
+
+    def _queued(self):
+        if len(self._pending) + len(self._pending_members) >= self.batch_size:
+            self._schedule_flush(0)
+        else:
+            self._schedule_flush(self.flush_interval)
+
+    async def members(self, key) -> set:
+        if (members := self.member_cache.get(key)) is None:
+            members = await self.backend.members(key)
+            self.member_cache.set(key, members)
+        members = set(members)
+        for changes in (self._writing_members.get(key, {}), self._pending_members.get(key, {})):
+            for member, present in changes.items():
+                (members.add if present else members.discard)(member)
+        return members
+
+    def add_member(self, key, member):
+        self._change_member(key, member, True)
+
+    def remove_member(self, key, member):
+        self._change_member(key, member, False)
+
+    def _change_member(self, key, member, present):
+        self._pending_members.setdefault(key, {})[member] = present
+        if (cached := self.member_cache.get(key)) is not None:
+            (cached.add if present else cached.discard)(member)
+        self._queued()
+
+    async def scan(self, prefix):
+        keys = set(await self.backend.scan(prefix))
+        for key, value in self._pending.items():
+            if key.startswith(prefix) and value is None:
+                keys.discard(key)
+            elif key.startswith(prefix):
+                keys.add(key)
+        return sorted(keys)
+
+    def _schedule_flush(self, delay):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_later(delay))
+        elif delay == 0 and not self._writing:
+            # only cancel one that is still waiting, a write in progress picks up the new keys when it is done
+            self._flush_task.cancel()
+            self._flush_task = asyncio.ensure_future(self._flush_later(0))
+
+    async def _flush_later(self, delay):
+        if delay:
+            await asyncio.sleep(delay)
+        while not await self.flush():  # waits outside the lock, so `close` is not stuck behind it
+            await asyncio.sleep(RETRY_DELAY)
+
+    async def flush(self, attempts=1, drop=False):
+        """
+        Write everything pending, a failing batch is tried `attempts` times.
+        False if it still failed: the batch is kept for the next flush, or dropped with `drop`
+        """
+        async with self._flush_lock:
+            failures = 0
+            while self._pending or self._pending_members:
+                batch, self._pending = self._pending, {}
+                members, self._pending_members = self._pending_members, {}
+                self._writing, self._writing_members = True, members
+                try:
+                    if batch:
+                        await self.backend.set_many(batch)
+                    if members:
+                        await self.backend.update_sets(members)
+                except Exception:
+                    failures += 1
+                    if drop and failures >= attempts:
+                        logger.exception("Storage flush of %d keys failed %d times, dropping them",
+                                         len(batch) + len(members), failures)
+                        continue
+                    logger.exception("Storage flush of %d keys failed, will retry", len(batch) + len(members))
+                    self._restore(batch, members)
+                    if failures >= attempts:
+                        return False
+                    await asyncio.sleep(RETRY_DELAY)
+                except BaseException:  # cancelled mid-write, the batch goes out with the next flush
+                    self._restore(batch, members)
+                    raise
+                finally:
+                    self._writing, self._writing_members = False, {}
+            return True
+
+    def _restore(self, batch, members):
+        """ Put a failed batch back under whatever was written since """
+        self._pending = {**batch, **self._pending}
+        for key, changes in members.items():
+            self._pending_members[key] = {**changes, **self._pending_members.get(key, {})}
+
+    async def close(self):
+        if self._flush_task is not None and not self._writing:
+            self._flush_task.cancel()
+        await self.flush(CLOSE_ATTEMPTS, drop=True)  # waits for a write in progress
+        await self.backend.close()
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# run from anywhere: the bot imports its modules relative to DixitGP/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("ADMINS_IDS", "0")
+os.environ.setdefault("API_URL", "http://127.0.0.1:1/")
+os.environ.setdefault("STORAGE_URL", "memory://")
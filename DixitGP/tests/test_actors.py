@@ -0,0 +1,157 @@
+import asyncio
+import contextvars
+
+import pytest
+
+from utils.actors import Actors, detached
+
+request_var = contextvars.ContextVar('request_var', default=None)
+
+
+def test_same_key_is_serialized_other_keys_are_not():
+    async def main():
+        actors, log = Actors(), []
+
+        async def job(name, delay):
+            log.append(f"{name} start")
+            await asyncio.sleep(delay)
+            log.append(f"{name} end")
+
+        await asyncio.gather(actors.run('A', job, 'a1', 0.02), actors.run('A', job, 'a2', 0),
+                             actors.run('B', job, 'b1', 0.01))
+        return log
+
+    log = asyncio.run(main())
+    assert log.index('a1 end') < log.index('a2 start')
+    assert log.index('b1 start') < log.index('a1 end')
+
+
+def test_failure_is_returned_to_its_caller_only():
+    async def main():
+        actors = Actors()
+
+        async def fail():
+            raise ValueError
+
+        async def ok():
+            return 'ok'
+
+        results = await asyncio.gather(actors.run('A', fail), actors.run('A', ok), return_exceptions=True)
+        assert isinstance(results[0], ValueError) and results[1] == 'ok'
+        assert actors.stats() == {}
+
+    asyncio.run(main())
+
+
+def test_reentrant_run_is_inline():
+    async def main():
+        actors = Actors()
+
+        async def inner():
+            return 'inner'
+
+        async def outer():
+            return await actors.run('A', inner)
+
+        assert await asyncio.wait_for(actors.run('A', outer), 1) == 'inner'
+
+    asyncio.run(main())
+
+
+def test_marker_is_per_instance():
+    async def main():
+        games, chats, log = Actors(), Actors(), []
+
+        async def game_job(name, delay):
+            log.append(f"{name} start")
+            await asyncio.sleep(delay)
+            log.append(f"{name} end")
+
+        async def chat_job():
+            # 'A' in another Actors is not held by this job, it must queue behind the running game job
+            await games.run('A', game_job, 'from chat', 0)
+
+        await asyncio.gather(games.run('A', game_job, 'first', 0.02), chats.run('A', chat_job))
+        return log
+
+    assert asyncio.run(main()) == ['first start', 'first end', 'from chat start', 'from chat end']
+
+
+def test_detached_task_queues_behind_its_job():
+    async def main():
+        actors, log = Actors(), []
+
+        async def later():
+            log.append('background')
+
+        async def job():
+            task = detached(actors.run('A', later))
+            await asyncio.sleep(0.01)
+            log.append('job done')
+            return task
+
+        task = await actors.run('A', job)
+        await task
+        return log
+
+    assert asyncio.run(main()) == ['job done', 'background']
+
+
+def test_jobs_run_in_their_callers_context():
+    async def main():
+        actors = Actors()
+
+        async def job():
+            await asyncio.sleep(0)
+            return request_var.get()
+
+        async def caller(value):
+            request_var.set(value)
+            return await actors.run('A', job)
+
+        assert await asyncio.gather(caller('first'), caller('second')) == ['first', 'second']
+
+    asyncio.run(main())
+
+
+def test_idle_mailboxes_are_dropped_unless_kept():
+    async def main():
+        alive = {'A'}
+        actors = Actors(keep=lambda key: key in alive)
+
+        async def finish_game():
+            alive.discard('B')
+            actors.forget('B')  # busy, the worker drops it when done
+
+        async def job():
+            pass
+
+        alive.add('B')
+        await actors.run('A', job)
+        await actors.run('B', finish_game)
+        assert list(actors.stats()) == ['A']
+        assert actors.stats()['A']['processed'] == 1
+        alive.discard('A')
+        actors.forget('A')
+        assert len(actors) == 0
+
+    asyncio.run(main())
+
+
+def test_cancelled_worker_cancels_queued_callers():
+    async def main():
+        actors = Actors()
+
+        async def job():
+            await asyncio.sleep(10)
+
+        first = asyncio.ensure_future(actors.run('A', job))
+        second = asyncio.ensure_future(actors.run('A', job))
+        await asyncio.sleep(0.01)
+        actors._mailboxes['A'].worker.cancel()
+        for caller in (first, second):
+            with pytest.raises(asyncio.CancelledError):
+                await caller
+        assert len(actors) == 0
+
+    asyncio.run(main())
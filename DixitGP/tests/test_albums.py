@@ -0,0 +1,50 @@
+import asyncio
+from types import SimpleNamespace
+
+from handlers import cards
+
+
+class Index:
+    def __init__(self):
+        self.cards = set()
+
+    async def add(self, player_id, unique_id, value_hash, card_id):
+        self.cards.add(unique_id)
+
+    async def remove(self, player_id, unique_id):
+        self.cards.discard(unique_id)
+
+
+def test_slow_album_is_added_in_one_call(monkeypatch):
+    calls, replies, index = [], [], Index()
+
+    async def find_duplicate(message):
+        await asyncio.sleep(0.03)  # download and hash take longer than the window
+        photo = message.photo[-1]
+        return ('copy' if photo.file_unique_id == 'u3' else None), 1
+
+    async def add_cards(card_ids, player_id):
+        calls.append(card_ids)
+        return {card_id: None if card_id == 'f4' else {} for card_id in card_ids}
+
+    async def call(chat_id, func, text, **kwargs):
+        replies.append(text)
+
+    monkeypatch.setattr(cards, 'ALBUM_WINDOW', 0.02)
+    monkeypatch.setattr(cards, 'find_duplicate', find_duplicate)
+    monkeypatch.setattr(cards, 'card_index', index)
+    monkeypatch.setattr(cards.api, 'add_cards', add_cards)
+    monkeypatch.setattr(cards.scheduler, 'call', call)
+
+    async def main():
+        for i in range(5):  # one chat's updates run one after another
+            photo = SimpleNamespace(file_id=f"f{i}", file_unique_id=f"u{i}")
+            message = SimpleNamespace(media_group_id='album', chat=SimpleNamespace(id=1), photo=[photo], reply=None)
+            await cards.add_album_photo(message, photo)
+        await asyncio.gather(*cards._album_tasks)
+
+    asyncio.run(main())
+    assert calls == [['f0', 'f1', 'f2', 'f4']]
+    assert replies == ["Додано карток: 3\nНе вдалося додати: 1\nВже є в колоді: 1"]
+    assert index.cards == {'u0', 'u1', 'u2'}
+    assert cards.general.groups == {}
@@ -0,0 +1,166 @@
+import asyncio
+
+from api import API
+from utils.cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeBackend:
+    """ `API._request` replacement: lobby reads and joins, each request can be held until released """
+
+    def __init__(self):
+        self.players = ['admin']
+        self.calls = []
+        self.gates = {}  # endpoint -> event the next request of it waits for
+        self.started = asyncio.Event()
+
+    async def request(self, method, endpoint, token=None, session=None, **kwargs):
+        self.calls.append(endpoint)
+        self.started.set()
+        if endpoint == 'get_lobby_info':
+            snapshot = list(self.players)  # read before waiting, like a slow response
+            if gate := self.gates.pop(endpoint, None):
+                await gate.wait()
+            return {'players': snapshot}
+        if gate := self.gates.pop(endpoint, None):
+            await gate.wait()
+        self.players.append(kwargs['json']['player_id'])
+        return {'ok': True}
+
+
+def make_api():
+    api, backend = API(), FakeBackend()
+    api._request = backend.request
+    return api, backend
+
+
+def lobby(api):
+    return api.request('post', 'get_lobby_info', json={'code': 'G'})
+
+
+def join(api, player):
+    return api.request('post', 'connect_to_game', json={'code': 'G', 'player_id': player})
+
+
+def test_ttl_expiry():
+    clock = Clock()
+    cache = TTLCache(maxsize=10, ttl=5, timer=clock)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=1)
+    clock.now = 2
+    assert cache.get('a') == 1
+    assert cache.get('b') is None and 'b' not in cache
+    clock.now = 5
+    assert cache.get('a', 'gone') == 'gone'
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_lru_eviction():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.keys() == ['a', 'c']
+
+
+def test_reads_are_coalesced_and_cached():
+    async def main():
+        api, backend = make_api()
+        first, second = await asyncio.gather(lobby(api), lobby(api))
+        assert first is second
+        await lobby(api)
+        assert backend.calls == ['get_lobby_info']
+
+    asyncio.run(main())
+
+
+def test_mutation_invalidates_matching_reads():
+    async def main():
+        api, backend = make_api()
+        await lobby(api)
+        await api.request('post', 'get_lobby_info', json={'code': 'other'})
+        await join(api, 'A')
+        assert (await lobby(api))['players'] == ['admin', 'A']
+        await api.request('post', 'get_lobby_info', json={'code': 'other'})
+        assert backend.calls.count('get_lobby_info') == 3  # 'other' is still cached
+
+    asyncio.run(main())
+
+
+def test_read_during_mutation_is_not_cached():
+    async def main():
+        api, backend = make_api()
+        backend.gates['connect_to_game'] = mutation = asyncio.Event()
+        joining = asyncio.ensure_future(join(api, 'A'))
+        await backend.started.wait()
+        assert (await lobby(api))['players'] == ['admin']  # the backend has not applied the join yet
+        mutation.set()
+        await joining
+        assert (await lobby(api))['players'] == ['admin', 'A']
+
+    asyncio.run(main())
+
+
+def test_read_in_flight_across_mutation_is_not_cached():
+    async def main():
+        api, backend = make_api()
+        backend.gates['get_lobby_info'] = read = asyncio.Event()
+        reading = asyncio.ensure_future(lobby(api))
+        await backend.started.wait()
+        await join(api, 'A')
+        read.set()
+        assert (await reading)['players'] == ['admin']
+        assert (await lobby(api))['players'] == ['admin', 'A']
+
+    asyncio.run(main())
+
+
+def test_failed_mutation_still_invalidates():
+    async def main():
+        api, backend = make_api()
+        await lobby(api)
+
+        async def failing(*args, **kwargs):
+            backend.players.append('half-applied')
+            raise ConnectionError
+
+        api._request = failing
+        try:
+            await join(api, 'A')
+        except ConnectionError:
+            pass
+        api._request = backend.request
+        assert (await lobby(api))['players'] == ['admin', 'half-applied']
+
+    asyncio.run(main())
+
+
+def test_moves_drop_cached_game_info():
+    async def main():
+        api, moves = API(), []
+
+        async def request(method, endpoint, token=None, session=None, **kwargs):
+            if endpoint == 'get_game_info':
+                return {'moves': len(moves)}
+            moves.append(endpoint)
+            return {}
+
+        api._request = request
+        info = lambda: api.request('post', 'get_game_info', json={'code': 'G'})
+        assert await info() == {'moves': 0}
+        await api.send_riddle('G', 1, 'riddle', 'card')
+        assert await info() == {'moves': 1}
+        await api.send_association('G', 2, 'card')
+        assert await info() == {'moves': 2}
+        await api.send_guess('G', 2, 'card')
+        assert await info() == {'moves': 3}
+
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+import asyncio
+import random
+
+from utils.duplicates import BKTree, CardIndex, hamming
+
+
+def test_hamming():
+    assert hamming(0, 0) == 0
+    assert hamming(0b1011, 0b0001) == 2
+    assert hamming(0, (1 << 64) - 1) == 64
+
+
+def test_search_matches_brute_force():
+    rng = random.Random(1)
+    hashes = [rng.getrandbits(64) for _ in range(300)]
+    base = hashes[0]
+    hashes += [base ^ (1 << bit) for bit in range(0, 64, 7)]  # close relatives of the first one
+    tree = BKTree()
+    for i, value_hash in enumerate(hashes):
+        tree.add(value_hash, i)
+    for query in (base, hashes[5], rng.getrandbits(64)):
+        for radius in (0, 1, 6, 20):
+            expected = sorted((hamming(query, h), i) for i, h in enumerate(hashes) if hamming(query, h) <= radius)
+            found = tree.search(query, radius)
+            assert sorted(found) == expected
+            assert [distance for distance, _ in found] == sorted(distance for distance, _ in found)
+
+
+def test_same_hash_keeps_every_value():
+    tree = BKTree()
+    tree.add(0xF0, 'a')
+    tree.add(0xF0, 'b')
+    assert sorted(tree.search(0xF0, 0)) == [(0, 'a'), (0, 'b')]
+    assert tree.search(0x0F, 4) == []
+
+
+def test_index_is_per_player_and_persistent(tmp_path):
+    path = str(tmp_path / 'cards.sqlite3')
+    high = 1 << 63 | 0b1111  # top bit set, stored as a negative sqlite integer
+
+    async def first():
+        index = CardIndex(path, max_distance=4)
+        await index.add(1, 'photo', high, 'file-1')
+        assert await index.find(1, 'photo') == 'file-1'
+        assert await index.find(1, 'resized', high ^ 0b11) == 'file-1'  # near duplicate
+        assert await index.find(1, 'other', high ^ 0xFF) is None
+        assert await index.find(2, 'photo', high) is None  # another player's deck
+        await index.add(2, 'photo', high, 'file-2')
+        await index.close()
+
+    async def second():
+        index = CardIndex(path, max_distance=4)
+        await asyncio.gather(index.load(), index.load())
+        assert await index.find(2, 'resized', high ^ 1) == 'file-2'
+        await index.remove(1, 'photo')
+        assert await index.find(1, 'photo', high) is None
+        assert await index.find(2, 'photo') == 'file-2'
+        await index.close()
+        assert (await asyncio.get_running_loop().run_in_executor(None, CardIndex(path)._read)) == [
+            (2, 'photo', high - (1 << 64), 'file-2')]
+
+    asyncio.run(first())
+    asyncio.run(second())
@@ -0,0 +1,23 @@
+import asyncio
+
+import pytest
+
+from utils.loop_monitor import LoopMonitor
+
+
+def test_restarts_after_a_failed_start_on_another_loop():
+    monitor = LoopMonitor(interval=0.01)
+
+    async def failed_start():
+        monitor.start()
+        raise ConnectionError  # stop() is never called, like a NetworkError during startup
+
+    async def reconnect():
+        monitor.start()
+        await asyncio.sleep(0.1)
+        monitor.stop()
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(failed_start())
+    asyncio.run(reconnect())
+    assert len(monitor.lags) > 0
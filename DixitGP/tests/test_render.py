@@ -0,0 +1,30 @@
+import asyncio
+import threading
+
+from utils import render
+from utils.render import Renderer
+
+
+def test_background_renders_wait_for_real_ones(monkeypatch):
+    started, release = [], threading.Event()
+
+    def render_card(data, label, max_side):
+        started.append(data)
+        release.wait(5)
+        return data
+
+    monkeypatch.setattr(render, 'render_card', render_card)
+
+    async def main():
+        renderer = Renderer('thread', workers=2)
+        real = asyncio.ensure_future(renderer.render(b'real', 1))
+        await asyncio.sleep(0.05)
+        spare = asyncio.ensure_future(renderer.render(b'spare', 1, background=True))
+        await asyncio.sleep(0.05)
+        assert started == [b'real']  # a worker is free, but a real render is still going
+        release.set()
+        assert await asyncio.gather(real, spare) == [b'real', b'spare']
+        assert started == [b'real', b'spare']
+        renderer.shutdown()
+
+    asyncio.run(main())
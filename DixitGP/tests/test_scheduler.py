@@ -0,0 +1,110 @@
+import asyncio
+import contextvars
+
+import pytest
+from aiogram.utils.exceptions import RetryAfter
+
+from utils.scheduler import SendScheduler, TokenBucket, Priority
+
+request_var = contextvars.ContextVar('request_var', default=None)
+
+
+def run(test, scheduler):
+    async def main():
+        try:
+            return await asyncio.wait_for(test(scheduler), 5)
+        finally:
+            await scheduler.stop()
+
+    return asyncio.run(main())
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=2, capacity=2, now=0.0)
+    bucket.take(0.0)
+    bucket.take(0.0)
+    assert bucket.wait_time(0.0) == pytest.approx(0.5)
+    assert bucket.wait_time(0.5) == 0.0
+    bucket.pause(3.0)
+    assert bucket.wait_time(1.0) == pytest.approx(2.0)
+    assert not bucket.idle(2.0) and bucket.idle(3.0)
+
+
+def test_priority_order():
+    async def main(scheduler):
+        order = []
+
+        async def send(name):
+            order.append(name)
+
+        await asyncio.gather(
+            scheduler.call(None, send, 'bulk', priority=Priority.BULK),
+            scheduler.call(None, send, 'normal'),
+            scheduler.call(None, send, 'interactive', priority=Priority.INTERACTIVE),
+        )
+        return order
+
+    scheduler = SendScheduler(rate=1000, burst=1)
+    assert run(main, scheduler) == ['interactive', 'normal', 'bulk']
+
+
+def test_busy_chat_does_not_block_others():
+    async def main(scheduler):
+        done = []
+
+        async def send(name):
+            done.append(name)
+
+        first = asyncio.ensure_future(scheduler.call(1, send, 'a1'))
+        second = asyncio.ensure_future(scheduler.call(1, send, 'a2'))
+        await scheduler.call(2, send, 'b')
+        await first
+        assert not second.done()  # chat 1 waits for a token, chat 2 went ahead
+        second.cancel()
+        return done
+
+    scheduler = SendScheduler(rate=1000, burst=10, chat_rate=0.1, chat_burst=1)
+    assert sorted(run(main, scheduler)) == ['a1', 'b']
+
+
+def test_retry_after_requeues_and_pauses_chat():
+    async def main(scheduler):
+        attempts = []
+
+        async def send():
+            attempts.append(scheduler.timer())
+            if len(attempts) == 1:
+                raise RetryAfter(0)
+            return 'sent'
+
+        assert await scheduler.call(1, send) == 'sent'
+        assert len(attempts) == 2 and scheduler.retry_after_count == 1
+
+    run(main, SendScheduler(rate=1000, burst=10))
+
+
+def test_retry_after_gives_up():
+    async def main(scheduler):
+        async def send():
+            raise RetryAfter(0)
+
+        with pytest.raises(RetryAfter):
+            await scheduler.call(None, send)
+        assert scheduler.retry_after_count == scheduler.max_retries + 1
+
+    run(main, SendScheduler(rate=1000, burst=10, max_retries=2))
+
+
+def test_jobs_run_in_their_callers_context():
+    async def main(scheduler):
+        async def send():
+            return request_var.get()
+
+        async def caller(value):
+            request_var.set(value)
+            return await scheduler.call(None, send)
+
+        assert await asyncio.gather(caller('first'), caller('second')) == ['first', 'second']
+        assert await scheduler.call(None, send) is None  # not the context of whoever started the worker
+
+    run(main, SendScheduler(rate=1000, burst=10))
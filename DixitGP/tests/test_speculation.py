@@ -0,0 +1,81 @@
+import asyncio
+
+from handlers import game
+from handlers.game import DixitEngine, prerendered
+from storage import MemoryBackend, Store
+
+
+class Renders:
+    """ Stand-in for DixitEngine._prerender: every render waits until released """
+
+    def __init__(self):
+        self.started, self.cancelled = [], []
+        self.release = asyncio.Event()
+
+    async def __call__(self, bot, file, label):
+        self.started.append((file, label))
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled.append((file, label))
+            raise
+        return f"{file}:{label}".encode()
+
+
+def engine(monkeypatch):
+    monkeypatch.setattr(game.renderer, 'workers', 4)  # speculation needs a spare render worker
+    de = DixitEngine(Store(MemoryBackend()))
+    de._prerender = Renders()
+    return de
+
+
+def test_discard_cancels_renders_not_taken(monkeypatch):
+    async def main():
+        prerendered.clear()
+        de = engine(monkeypatch)
+        de.speculate('G', {1: ['a']})  # a stays card 1 or becomes card 0 of the next hand
+        await asyncio.sleep(0)
+        assert sorted(de._prerender.started) == [('a', 1)]
+        taken = asyncio.ensure_future(de.take_prerendered(None, 'a', 1))
+        await asyncio.sleep(0)
+        de.discard_speculation('G')
+        de._prerender.release.set()
+        assert await taken == b'a:1'  # taken before the discard, not cancelled under its reader
+        assert de.prerender_hits == 1
+
+        de._prerender.release.clear()
+        de.speculate('G', {1: ['b', 'c']})
+        await asyncio.sleep(0)
+        de.discard_speculation('G')
+        await asyncio.sleep(0.01)
+        assert sorted(de._prerender.cancelled) == [('b', 1), ('c', 1), ('c', 2)]
+        assert len(prerendered) == 0 and de.stats()['speculating'] == 0
+
+    asyncio.run(main())
+
+
+def test_queue_is_capped(monkeypatch):
+    monkeypatch.setattr(game, 'PRERENDER_QUEUE', 3)
+
+    async def main():
+        prerendered.clear()
+        de = engine(monkeypatch)
+        de.speculate('G', {1: ['a', 'b'], 2: ['c', 'd']})
+        assert de.stats()['speculating'] == 3
+        de.discard_speculation('G')
+        await asyncio.sleep(0.01)
+        assert de.stats()['speculating'] == 0
+        de.speculate('H', {1: ['e', 'f']})  # room again after the discard
+        assert de.stats()['speculating'] == 3
+
+    asyncio.run(main())
+
+
+def test_single_render_worker_does_not_speculate(monkeypatch):
+    async def main():
+        de = engine(monkeypatch)
+        monkeypatch.setattr(game.renderer, 'workers', 1)
+        de.speculate('G', {1: ['a', 'b']})
+        assert de.stats()['speculating'] == 0
+
+    asyncio.run(main())
@@ -0,0 +1,202 @@
+import asyncio
+import importlib
+from types import SimpleNamespace
+
+from storage import MemoryBackend, SQLiteBackend, Store
+
+store_module = importlib.import_module('storage.store')  # `storage.store` is the shared Store
+
+
+class SlowBackend(MemoryBackend):
+    """ MemoryBackend whose writes can be held, or fail once """
+
+    def __init__(self):
+        super().__init__()
+        self.writes = []
+        self.gate: asyncio.Event | None = None
+        self.fail = False
+
+    async def set_many(self, items):
+        self.writes.append(dict(items))
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.fail:
+            self.fail = False
+            raise ConnectionError
+        await super().set_many(items)
+
+
+def test_writes_are_batched_and_visible_at_once():
+    async def main():
+        backend = SlowBackend()
+        store = Store(backend, flush_interval=0.01)
+        store.set('a', {'n': 1})
+        store.set('b', 2)
+        store.set('a', {'n': 3})
+        assert await store.get('a') == {'n': 3}
+        assert backend.data == {}
+        await asyncio.sleep(0.05)
+        assert backend.writes == [{'a': {'n': 3}, 'b': 2}]
+        await store.close()
+
+    asyncio.run(main())
+
+
+def test_values_are_copies():
+    async def main():
+        store = Store(MemoryBackend())
+        value = {'players': [1]}
+        store.set('a', value)
+        value['players'].append(2)
+        (await store.get('a'))['players'].append(3)
+        assert await store.get('a') == {'players': [1]}
+        await store.close()
+
+    asyncio.run(main())
+
+
+def test_delete_and_scan_merge_pending():
+    async def main():
+        backend = MemoryBackend()
+        await backend.set_many({'game:A': 1, 'game:B': 2, 'player:1': 3})
+        store = Store(backend)
+        store.delete('game:A')
+        store.set('game:C', 4)
+        assert await store.scan('game:') == ['game:B', 'game:C']
+        assert await store.get('game:A') is None
+        await store.close()
+        assert backend.data.keys() == {'game:B', 'game:C', 'player:1'}
+
+    asyncio.run(main())
+
+
+def test_failed_flush_is_retried_and_newer_writes_win():
+    async def main():
+        backend = SlowBackend()
+        backend.gate, backend.fail = asyncio.Event(), True
+        store = Store(backend, flush_interval=0)
+        store.set('a', 1)
+        await asyncio.sleep(0.01)  # the write of a=1 is in flight
+        store.set('a', 2)
+        backend.gate.set()
+        await asyncio.sleep(1.1)  # failed, retried after a second
+        assert await backend.get_many(['a']) == {'a': 2}
+        await store.close()
+
+    asyncio.run(main())
+
+
+def test_full_batch_does_not_cancel_a_write_in_progress():
+    async def main():
+        backend = SlowBackend()
+        backend.gate = asyncio.Event()
+        store = Store(backend, flush_interval=0, batch_size=2)
+        store.set('a', 1)
+        await asyncio.sleep(0.01)
+        store.set('b', 2)
+        store.set('c', 3)  # a full batch asks for an immediate flush
+        await asyncio.sleep(0.01)
+        backend.gate.set()
+        await store.close()
+        assert backend.data.keys() == {'a', 'b', 'c'}
+
+    asyncio.run(main())
+
+
+def test_cancelled_write_keeps_its_batch():
+    async def main():
+        backend = SlowBackend()
+        backend.gate = asyncio.Event()
+        store = Store(backend, flush_interval=0)
+        store.set('a', 1)
+        await asyncio.sleep(0.01)
+        store._flush_task.cancel()
+        await asyncio.sleep(0.01)
+        backend.gate.set()
+        await store.close()
+        assert await backend.get_many(['a']) == {'a': 1}
+
+    asyncio.run(main())
+
+
+def test_close_waits_for_a_write_in_progress():
+    async def main():
+        backend = SlowBackend()
+        backend.gate = asyncio.Event()
+        store = Store(backend, flush_interval=0)
+        store.set('a', 1)
+        await asyncio.sleep(0.01)
+        store.set('b', 2)
+        asyncio.get_running_loop().call_later(0.01, backend.gate.set)
+        await store.close()
+        assert backend.data.keys() == {'a', 'b'}
+
+    asyncio.run(main())
+
+
+def test_close_gives_up_on_a_backend_that_stays_down(monkeypatch, caplog):
+    monkeypatch.setattr(store_module, 'RETRY_DELAY', 0.01)
+
+    class DownBackend(MemoryBackend):
+        async def set_many(self, items):
+            raise ConnectionError
+
+    async def main():
+        store = Store(DownBackend(), flush_interval=0)
+        store.set('a', 1)
+        await asyncio.sleep(0.05)  # the background flush keeps retrying
+        await asyncio.wait_for(store.close(), 1)
+        assert store._pending == {}
+
+    asyncio.run(main())
+    assert "failed 3 times, dropping them" in caplog.text
+
+
+def test_member_changes_merge_across_stores(tmp_path):
+    async def main(backend):
+        first, second = Store(backend), Store(backend)
+        first.add_member('members:G', 1)
+        await first.flush()
+        assert await second.members('members:G') == {1}  # cached from here on
+        first.add_member('members:G', 2)
+        second.add_member('members:G', 3)
+        second.remove_member('members:G', 1)
+        assert await second.members('members:G') == {3}  # own changes are visible at once
+        await asyncio.gather(first.flush(), second.flush())
+        assert await backend.members('members:G') == {2, 3}
+        await first.close()
+        await second.close()
+
+    asyncio.run(main(MemoryBackend()))
+    asyncio.run(main(SQLiteBackend(str(tmp_path / 'state.sqlite3'))))
+
+
+def test_concurrent_joins_in_two_processes_keep_both_players(tmp_path):
+    from handlers.game import DixitEngine
+
+    def message(player):
+        return SimpleNamespace(message_id=player * 10, chat=SimpleNamespace(id=player))
+
+    async def main():
+        backend = SQLiteBackend(str(tmp_path / 'state.sqlite3'))
+        first, second = DixitEngine(Store(backend)), DixitEngine(Store(backend))
+        first.add('G', 1, message(1))
+        await first.store.flush()
+        assert (await first.refresh_game('G')).players == {1}
+        assert (await second.refresh_game('G')).players == {1}
+        first.add('G', 2, message(2))
+        second.add('G', 3, message(3))
+        await asyncio.gather(first.store.flush(), second.store.flush())
+
+        third = DixitEngine(Store(backend))
+        assert (await third.refresh_game('G')).players == {1, 2, 3}
+        assert set(third.players) == {1, 2, 3}
+
+        second.remove('G', 3)
+        await second.store.flush()
+        assert (await DixitEngine(Store(backend)).refresh_game('G')).players == {1, 2}
+        for engine in (first, second, third):
+            engine._expire_task.cancel()
+            await engine.store.close()
+
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger("actors")
+
+# (id(actors), key) of every mailbox whose job the current task is part of
+_current_actor = contextvars.ContextVar('current_actor', default=frozenset())
+
+
+def detached(coro) -> asyncio.Task:
+    """ ensure_future for background work started from a job: the task is not part of the job and queues normally """
+    context = contextvars.copy_context()
+    context.run(_current_actor.set, frozenset())
+    return context.run(asyncio.ensure_future, coro)
+
+
+class Mailbox:
+    __slots__ = ('queue', 'worker', 'processed', 'failed', 'busy_time', 'wait_time', 'max_latency')
+
+    def __init__(self):
+        self.queue = deque()
+        self.worker: asyncio.Task | None = None
+        self.processed = 0
+        self.failed = 0
+        self.busy_time = 0.0
+        self.wait_time = 0.0
+        self.max_latency = 0.0
+
+    @property
+    def depth(self):
+        return len(self.queue) + (self.worker is not None)
+
+
+class Actors:
+    """
+    One mailbox per key (game code): jobs for the same key run one after another in submit order,
+    jobs for different keys run concurrently. A worker task only exists while its mailbox has work,
+    an idle mailbox is dropped unless `keep(key)` says its stats are still wanted.
+    Every job runs as its own task in the context of whoever submitted it.
+    """
+
+    def __init__(self, keep=None):
+        self.keep = keep
+        self._mailboxes: dict[str, Mailbox] = {}
+
+    async def run(self, key, func, *args, **kwargs):
+        held = _current_actor.get()
+        if (id(self), key) in held:  # already inside this actor, queueing would deadlock
+            return await func(*args, **kwargs)
+        if (mailbox := self._mailboxes.get(key)) is None:
+            mailbox = self._mailboxes[key] = Mailbox()
+        context = contextvars.copy_context()
+        context.run(_current_actor.set, held | {(id(self), key)})
+        future = asyncio.get_running_loop().create_future()
+        mailbox.queue.append((func, args, kwargs, future, time.monotonic(), context))
+        if mailbox.worker is None:
+            # the worker serves every later caller too, it must not keep this one's context
+            mailbox.worker = contextvars.Context().run(asyncio.ensure_future, self._work(key, mailbox))
+        return await future
+
+    async def _work(self, key, mailbox: Mailbox):
+        try:
+            while mailbox.queue:
+                func, args, kwargs, future, queued_at, context = mailbox.queue.popleft()
+                if future.done():  # caller gave up
+                    continue
+                started = time.monotonic()
+                try:
+                    result = await context.run(asyncio.ensure_future, func(*args, **kwargs))
+                except asyncio.CancelledError:
+                    future.cancel()
+                    while mailbox.queue:
+                        mailbox.queue.popleft()[3].cancel()
+                    raise
+                except Exception as e:
+                    mailbox.failed += 1
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+                finished = time.monotonic()
+                mailbox.processed += 1
+                mailbox.busy_time += finished - started
+                mailbox.wait_time += started - queued_at
+                mailbox.max_latency = max(mailbox.max_latency, finished - queued_at)
+        finally:
+            mailbox.worker = None
+            if not mailbox.queue and self._mailboxes.get(key) is mailbox and not (self.keep and self.keep(key)):
+                del self._mailboxes[key]
+
+    def forget(self, key):
+        """ Drop an idle mailbox now, a busy one goes when its worker runs out of work, unless `keep` wants it """
+        if (mailbox := self._mailboxes.get(key)) and not mailbox.depth:
+            del self._mailboxes[key]
+
+    def __len__(self):
+        return len(self._mailboxes)
+
+    def stats(self):
+        """ {key: metrics} for every known mailbox, latencies in seconds """
+        return {
+            key: {
+                "depth": mailbox.depth,
+                "processed": mailbox.processed,
+                "failed": mailbox.failed,
+                "avg_wait": mailbox.wait_time / mailbox.processed if mailbox.processed else 0.0,
+                "avg_busy": mailbox.busy_time / mailbox.processed if mailbox.processed else 0.0,
+                "max_latency": mailbox.max_latency,
+            }
+            for key, mailbox in self._mailboxes.items()
+        }
@@ -0,0 +1,140 @@
+import asyncio
+import io
+import logging
+import mmap
+import os
+from collections import OrderedDict
+
+import aiogram
+
+from config_reader import config
+from utils.cache import TTLCache
+
+logger = logging.getLogger("card_images")
+
+
+class CardImageCache:
+    """ Downloaded card photos on disk, addressed by file_unique_id, LRU within a byte budget """
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries: OrderedDict[str, int] | None = None  # file_unique_id -> bytes, oldest first
+        self._unique_ids = TTLCache(maxsize=100_000, ttl=24 * 60 * 60)  # file_id -> file_unique_id
+        self._downloads: dict[str, asyncio.Future] = {}
+        self._loading: asyncio.Future | None = None
+
+    def _path(self, unique_id):
+        return os.path.join(self.folder, unique_id[:2], unique_id)
+
+    def _scan(self):
+        files = []
+        for root, _, names in os.walk(self.folder):
+            for name in names:
+                if name.endswith('.tmp'):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                files.append((stat.st_atime, name, stat.st_size))
+        return OrderedDict((name, size) for _, name, size in sorted(files))
+
+    async def _load(self):
+        """ Index what is already on disk, the walk runs in an executor and only once """
+        if self._entries is not None:
+            return self._entries
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(asyncio.get_running_loop().run_in_executor(None, self._scan))
+        entries = await asyncio.shield(self._loading)
+        if self._entries is None:
+            self._entries = entries
+            self.size = sum(entries.values())
+            await self._evict()
+        return self._entries
+
+    async def open(self, bot: aiogram.Bot, file_id):
+        """ Readable binary file object with the photo, memory mapped when it is cached """
+        file = None
+        if (unique_id := self._unique_ids.get(file_id)) is None:
+            file = await bot.get_file(file_id)
+            unique_id = file.file_unique_id
+            self._unique_ids.set(file_id, unique_id)
+
+        entries = await self._load()
+        if unique_id in entries:
+            try:
+                mapped = self._map(unique_id, entries[unique_id])
+            except (OSError, ValueError) as e:  # gone, empty or cut short, download it again
+                logger.warning("Cached card %s is unusable: %r", unique_id, e)
+                self.size -= entries.pop(unique_id)
+                await self._remove([self._path(unique_id)])
+            else:
+                self.hits += 1
+                entries.move_to_end(unique_id)
+                return mapped
+
+        self.misses += 1
+        if (download := self._downloads.get(unique_id)) is None:
+            download = asyncio.ensure_future(self._download(bot, file or await bot.get_file(file_id), unique_id))
+            self._downloads[unique_id] = download
+            download.add_done_callback(lambda _: self._downloads.pop(unique_id, None))
+        return io.BytesIO(await asyncio.shield(download))
+
+    def _map(self, unique_id, size):
+        with open(self._path(unique_id), 'rb') as f:
+            if (actual := os.fstat(f.fileno()).st_size) != size or not size:
+                raise ValueError(f"{actual} bytes on disk, {size} expected")
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    async def _download(self, bot, file, unique_id):
+        data = (await bot.download_file(file.file_path)).getvalue()
+        if not data:
+            raise ValueError(f"Empty download of {unique_id}")
+        await asyncio.get_running_loop().run_in_executor(None, self._write, unique_id, data)
+        entries = await self._load()
+        self.size += len(data) - entries.get(unique_id, 0)
+        entries[unique_id] = len(data)
+        await self._evict()
+        return data
+
+    def _write(self, unique_id, data):
+        path = self._path(unique_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+
+    async def _evict(self):
+        paths = []
+        while self.size > self.max_bytes and self._entries:
+            unique_id, size = self._entries.popitem(last=False)
+            self.size -= size
+            paths.append(self._path(unique_id))
+        if paths:
+            await self._remove(paths)
+
+    @staticmethod
+    def _remove_files(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    async def _remove(self, paths):
+        await asyncio.get_running_loop().run_in_executor(None, self._remove_files, paths)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "files": len(self._entries or ()),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+card_images = CardImageCache(config.CARD_CACHE_PATH, config.CARD_CACHE_BYTES)
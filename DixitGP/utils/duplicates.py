@@ -0,0 +1,173 @@
+import asyncio
+import io
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from config_reader import config
+
+logger = logging.getLogger("duplicates")
+
+
+def dhash(data: bytes, size=8) -> int:
+    """ 64 bit difference hash: brightness gradients of a (size + 1) x size grayscale thumbnail """
+    image = Image.open(io.BytesIO(data))
+    image.draft('L', (size * 4, size * 4))  # jpeg decodes straight to a small grayscale image
+    pixels = list(image.convert('L').resize((size + 1, size), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left, right = pixels[row * (size + 1) + col], pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """ Metric tree over hamming distance, lookups within a small radius visit O(log n) nodes """
+
+    def __init__(self):
+        self.root = None  # [hash, set of values, {distance: child}]
+        self.size = 0
+
+    def add(self, value_hash, value):
+        self.size += 1
+        if self.root is None:
+            self.root = [value_hash, {value}, {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value_hash, node[0])
+            if distance == 0:
+                node[1].add(value)
+                return
+            if (child := node[2].get(distance)) is None:
+                node[2][distance] = [value_hash, {value}, {}]
+                return
+            node = child
+
+    def search(self, value_hash, radius):
+        """ [(distance, value)] of everything within `radius`, closest first """
+        found, stack = [], [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value_hash, node[0])
+            if distance <= radius:
+                found.extend((distance, value) for value in node[1])
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return sorted(found, key=lambda i: i[0])
+
+
+class CardIndex:
+    """
+    Cards already in each player's deck, by file_unique_id and perceptual hash.
+    Lookups are served from memory, SQLite is read once by `load` and written on a single thread like FileIdCache.
+    """
+
+    def __init__(self, path, max_distance=6):
+        self.path = path
+        self.max_distance = max_distance
+        self._db: sqlite3.Connection | None = None
+        self._cards: dict[tuple[int, str], tuple[int, str]] = {}  # (player, file_unique_id) -> (hash, card file id)
+        self._trees: dict[int, BKTree] = {}  # player -> hashes of their deck
+        self._loading: asyncio.Future | None = None
+        self._loaded = False
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='card_index')
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            if folder := os.path.dirname(self.path):
+                os.makedirs(folder, exist_ok=True)
+            self._db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS deck_cards (player_id INTEGER NOT NULL, unique_id TEXT NOT NULL,"
+                " hash INTEGER NOT NULL, card_id TEXT, PRIMARY KEY (player_id, unique_id))"
+            )
+        return self._db
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _read(self):
+        return self._connect().execute("SELECT player_id, unique_id, hash, card_id FROM deck_cards").fetchall()
+
+    async def load(self):
+        """ Read the whole index into memory, called on startup, later calls wait for the first one """
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(self._run(self._read))
+        try:
+            rows = await asyncio.shield(self._loading)
+        except Exception:
+            self._loading = None  # the next caller tries again
+            raise
+        if not self._loaded:  # the first waiter to wake up fills the index
+            self._loaded = True
+            for player_id, unique_id, value_hash, card_id in rows:
+                value_hash &= 0xFFFF_FFFF_FFFF_FFFF
+                self._cards[player_id, unique_id] = (value_hash, card_id)
+                self._tree(player_id).add(value_hash, unique_id)
+            logger.info(f"Card index loaded, {len(self._cards)} cards")
+
+    def _tree(self, player_id) -> BKTree:
+        if (tree := self._trees.get(player_id)) is None:
+            tree = self._trees[player_id] = BKTree()
+        return tree
+
+    async def find(self, player_id, unique_id, value_hash=None):
+        """
+        card file_id of a duplicate already in the player's deck, or None.
+        Without `value_hash` only exact matches
+        """
+        await self.load()
+        if card := self._cards.get((player_id, unique_id)):
+            return card[1]
+        if value_hash is None or (tree := self._trees.get(player_id)) is None:
+            return None
+        for distance, match in tree.search(value_hash, self.max_distance):
+            if card := self._cards.get((player_id, match)):  # removed cards stay in the tree
+                return card[1]
+        return None
+
+    def _add(self, player_id, unique_id, value_hash, card_id):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO deck_cards (player_id, unique_id, hash, card_id) VALUES (?, ?, ?, ?)",
+            (player_id, unique_id, value_hash - (1 << 64) if value_hash >= 1 << 63 else value_hash, card_id),
+        )
+
+    async def add(self, player_id, unique_id, value_hash, card_id):
+        """ Visible to `find` at once, written in background """
+        await self.load()
+        self._cards[player_id, unique_id] = (value_hash, card_id)
+        self._tree(player_id).add(value_hash, unique_id)
+        await self._run(self._add, player_id, unique_id, value_hash, card_id)
+
+    def _remove(self, player_id, unique_id):
+        self._connect().execute("DELETE FROM deck_cards WHERE player_id = ? AND unique_id = ?", (player_id, unique_id))
+
+    async def remove(self, player_id, unique_id):
+        await self.load()
+        self._cards.pop((player_id, unique_id), None)
+        await self._run(self._remove, player_id, unique_id)
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+        self._db = None
+
+    async def close(self):
+        await self._run(self._close)
+        self._cards.clear()
+        self._trees.clear()
+        self._loading, self._loaded = None, False
+
+
+card_index = CardIndex(config.CARD_INDEX_PATH, config.DUPLICATE_MAX_DISTANCE)
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config_reader import config
+
+logger = logging.getLogger("file_ids")
+
+TOUCH_BATCH = 256  # used_at updates written together
+EVICT_SLACK = 0.01  # share of maxsize evicted on top, so a full cache does not evict on every put
+
+
+class FileIdCache:
+    """
+    (source file_id, watermark label) -> file_id of the already uploaded marked card, LRU in SQLite.
+    Queries run on a single thread like SQLiteBackend's, lookups only queue their used_at update.
+    """
+
+    def __init__(self, path, maxsize=100_000):
+        self.path = path
+        self.maxsize = maxsize
+        self._db: sqlite3.Connection | None = None
+        self._count = 0  # rows, as far as this process knows, recounted before evicting
+        self._touched = {}  # (source, label) -> used_at not written yet
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='file_ids')
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            if folder := os.path.dirname(self.path):
+                os.makedirs(folder, exist_ok=True)
+            self._db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS marked ("
+                " source TEXT NOT NULL, label TEXT NOT NULL, file_id TEXT NOT NULL, used_at REAL NOT NULL,"
+                " PRIMARY KEY (source, label))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS marked_used_at ON marked (used_at)")
+            self._count = self._db.execute("SELECT COUNT(*) FROM marked").fetchone()[0]
+        return self._db
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _get_many(self, keys):
+        db, result = self._connect(), {}
+        for source, label in keys:
+            row = db.execute("SELECT file_id FROM marked WHERE source = ? AND label = ?", (source, label)).fetchone()
+            if row is not None:
+                result[source, label] = row[0]
+        return result
+
+    async def get_many(self, keys) -> list:
+        """ [file_id or None] for [(source, label)] """
+        keys = [(source, str(label)) for source, label in keys]
+        found = await self._run(self._get_many, keys)
+        now = time.time()
+        for key in keys:
+            if key in found:
+                self._touched[key] = now
+        if len(self._touched) >= TOUCH_BATCH:
+            touched, self._touched = self._touched, {}
+            await self._run(self._write_touches, touched)
+        return [found.get(key) for key in keys]
+
+    async def get(self, source, label):
+        return (await self.get_many([(source, label)]))[0]
+
+    def _write_touches(self, touched):
+        self._connect().executemany(
+            "UPDATE marked SET used_at = ? WHERE source = ? AND label = ?",
+            [(used_at, source, label) for (source, label), used_at in touched.items()],
+        )
+
+    def _put(self, source, label, file_id, touched):
+        db, now = self._connect(), time.time()
+        if db.execute("INSERT OR IGNORE INTO marked (source, label, file_id, used_at) VALUES (?, ?, ?, ?)",
+                      (source, label, file_id, now)).rowcount:
+            self._count += 1
+        else:
+            db.execute("UPDATE marked SET file_id = ?, used_at = ? WHERE source = ? AND label = ?",
+                       (file_id, now, source, label))
+        if self._count > self.maxsize:
+            self._write_touches(touched)  # evict by up to date used_at
+            self._evict(db)
+
+    async def put(self, source, label, file_id):
+        self._touched.pop((source, str(label)), None)
+        touched = {}
+        if self._count >= self.maxsize:
+            touched, self._touched = self._touched, {}
+        await self._run(self._put, source, str(label), file_id, touched)
+
+    def _delete(self, source, label):
+        self._count -= self._connect().execute(
+            "DELETE FROM marked WHERE source = ? AND label = ?", (source, label)).rowcount
+
+    async def delete(self, source, label):
+        self._touched.pop((source, str(label)), None)
+        await self._run(self._delete, source, str(label))
+
+    def _evict(self, db):
+        self._count = db.execute("SELECT COUNT(*) FROM marked").fetchone()[0]  # other processes write too
+        if (extra := self._count - self.maxsize) > 0:
+            extra += int(self.maxsize * EVICT_SLACK)
+            logger.info("Evicting %d cached file ids", extra)
+            self._count -= db.execute(
+                "DELETE FROM marked WHERE rowid IN (SELECT rowid FROM marked ORDER BY used_at LIMIT ?)", (extra,)
+            ).rowcount
+
+    def _close(self, touched):
+        if self._db is not None:
+            if touched:
+                self._write_touches(touched)
+            self._db.close()
+        self._db = None
+
+    async def close(self):
+        touched, self._touched = self._touched, {}
+        await self._run(self._close, touched)
+
+
+file_ids = FileIdCache(config.FILE_ID_CACHE_PATH, config.FILE_ID_CACHE_SIZE)
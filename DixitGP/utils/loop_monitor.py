@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+
+from config_reader import config
+from utils import metrics
+
+logger = logging.getLogger("loop")
+
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def _describe(handle: asyncio.Handle, context_before=None):
+    """ (callback, handler, update type) of a finished loop callback """
+    callback = handle._callback
+    if isinstance(task := getattr(callback, '__self__', None), asyncio.Task):  # a task step
+        coro = task.get_coro()
+        name = getattr(coro, '__qualname__', None) or task.get_name()
+    else:
+        name = getattr(callback, '__qualname__', None) or repr(callback)
+
+    def _from_context():
+        handler = current_handler.get(None)
+        update = types.Update.get_current()
+        update_type = next((key for key in update.to_python() if key != 'update_id'), None) if update else None
+        return (f"{handler.__module__}.{handler.__qualname__}" if handler else None), update_type
+
+    handler = update_type = None
+    # the handler may have finished within this callback, then only the context it started with knows it
+    for context in (getattr(handle, '_context', None), context_before):
+        if context is not None and not handler:
+            handler, update_type = context.run(_from_context)
+    return name, handler, update_type
+
+
+class LoopMonitor:
+    """
+    Samples how late the event loop wakes up a sleeping task and times every callback the loop runs,
+    callbacks longer than `slow_callback` are logged with the aiogram handler and update type they ran for.
+    """
+
+    def __init__(self, interval=0.1, slow_callback=0.1, window=600):
+        self.interval = interval
+        self.slow_callback = slow_callback
+        self.lags = deque(maxlen=max(1, int(window / interval)))  # rolling window of lag samples
+        self.slow = deque(maxlen=50)  # (time, duration, callback, handler, update type)
+        self.slow_count = 0
+        self._task: asyncio.Task | None = None
+        self._original_run = None
+
+    def start(self):
+        if self._task is not None:
+            if not self._task.done() and self._task.get_loop() is asyncio.get_running_loop():
+                return
+            self.stop()  # left over from a loop that is gone, e.g. a failed start before a reconnect
+        self._patch()
+        self._task = asyncio.ensure_future(self._sample())
+        if self not in metrics.collectors:
+            metrics.collectors.append(self)
+        logger.info(f"Loop monitor started, slow callback threshold {self.slow_callback * 1000:.0f} ms")
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        self._task = None
+        if self._original_run is not None:
+            asyncio.Handle._run = self._original_run
+        self._original_run = None
+
+    async def _sample(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - started - self.interval))
+
+    def _patch(self):
+        original = self._original_run = asyncio.Handle._run
+        monitor = self
+
+        def _run(handle):
+            context = handle._context.copy()  # O(1), contexts are immutable mappings underneath
+            started = time.perf_counter()
+            original(handle)
+            if (duration := time.perf_counter() - started) >= monitor.slow_callback:
+                monitor._report(handle, duration, context)
+
+        asyncio.Handle._run = _run  # TimerHandle and task steps go through it too
+
+    def _report(self, handle, duration, context_before=None):
+        try:
+            name, handler, update_type = _describe(handle, context_before)
+        except Exception as e:  # never break the loop because of monitoring
+            name, handler, update_type = repr(handle), None, None
+            logger.debug(f"Can't describe {handle!r}: {e!r}")
+        self.slow_count += 1
+        self.slow.append((time.time(), duration, name, handler, update_type))
+        logger.warning(f"Slow callback {duration * 1000:.0f} ms: {name}"
+                       + (f", handler {handler}" if handler else "")
+                       + (f", update {update_type}" if update_type else ""))
+
+    def stats(self):
+        """ Lag percentiles over the window, seconds """
+        ordered = sorted(self.lags)
+        return {
+            "samples": len(ordered),
+            "p50": _percentile(ordered, 0.5),
+            "p95": _percentile(ordered, 0.95),
+            "p99": _percentile(ordered, 0.99),
+            "max": ordered[-1] if ordered else 0.0,
+            "slow_callbacks": self.slow_count,
+        }
+
+    def prometheus(self):
+        stats = self.stats()
+        lines = ["# TYPE event_loop_lag_seconds summary"]
+        for quantile, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99")):
+            lines.append(f'event_loop_lag_seconds{{quantile="{quantile}"}} {stats[key]:.6f}')
+        lines.append("# TYPE event_loop_slow_callbacks_total counter")
+        lines.append(f"event_loop_slow_callbacks_total {self.slow_count}")
+        return "\n".join(lines) + "\n"
+
+
+loop_monitor = LoopMonitor(config.LOOP_MONITOR_INTERVAL, config.LOOP_SLOW_CALLBACK, config.LOOP_MONITOR_WINDOW)
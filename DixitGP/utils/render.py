@@ -0,0 +1,102 @@
+import asyncio
+import io
+import logging
+import math
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from PIL import Image
+
+from config_reader import config
+from utils import watermark
+
+logger = logging.getLogger("render")
+
+
+# decoded frames alive at once in this process, the executor may have more workers than that
+_frames = threading.BoundedSemaphore(config.RENDER_MAX_FRAMES or os.cpu_count() or 1)
+
+
+def _open_scaled(data, max_side) -> Image.Image:
+    """ Open a photo no bigger than `max_side`, jpeg is decoded straight at 1/2, 1/4 or 1/8 scale """
+    image = Image.open(io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data)
+    width, height = image.size
+    if max(width, height) > max_side:
+        scale = max_side / max(width, height)
+        image.draft('RGB', (math.ceil(width * scale), math.ceil(height * scale)))
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    return image
+
+
+def render_card(data, label, max_side=1280) -> bytes:
+    """ Decode -> watermark -> encode, runs inside the executor. `data` is bytes or a binary file object """
+    with _frames:
+        image = _open_scaled(data, max_side)
+        image = watermark.get_marked_image(image, label)
+        x = io.BytesIO()
+        image.save(x, format="jpeg")
+        del image
+    return x.getvalue()
+
+
+class Renderer:
+    def __init__(self, kind='thread', workers=0, queue_size=32, max_side=1280):
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Unknown executor kind {kind!r}")
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.max_side = max_side
+        self._executor: Executor | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._foreground = 0  # real renders queued or running
+        self._idle: asyncio.Event | None = None  # set while `_foreground` is 0
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            logger.info(f"Starting {self.kind} render pool with {self.workers} workers")
+            if self.kind == 'process':
+                self._executor = ProcessPoolExecutor(self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='render')
+        return self._executor
+
+    async def render(self, data, label, background=False) -> bytes:
+        """ `background` renders start only while no real render is queued or running """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.queue_size)
+            self._idle = asyncio.Event()
+            self._idle.set()
+        if background:
+            while self._foreground:
+                await self._idle.wait()
+            return await self._render(data, label)
+        self._foreground += 1
+        self._idle.clear()
+        try:
+            return await self._render(data, label)
+        finally:
+            self._foreground -= 1
+            if not self._foreground:
+                self._idle.set()
+
+    async def _render(self, data, label):
+        # at most `queue_size` cards are queued or rendering at once, the rest wait on the loop
+        async with self._semaphore:
+            if self.kind == 'process' and not isinstance(data, bytes):
+                data = data.read() if hasattr(data, 'read') else bytes(data)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, render_card, data, label, self.max_side)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self._semaphore = None
+        self._idle = None
+
+
+renderer = Renderer(config.RENDER_EXECUTOR, config.RENDER_WORKERS, config.RENDER_QUEUE_SIZE,
+                    config.RENDER_MAX_SIDE)
@@ -0,0 +1,196 @@
+import asyncio
+import contextvars
+import enum
+import logging
+import time
+from collections import deque
+
+from aiogram.utils.exceptions import RetryAfter
+
+from config_reader import config
+
+logger = logging.getLogger("scheduler")
+
+
+class Priority(enum.IntEnum):
+    INTERACTIVE = 0  # edits and answers the user is looking at
+    NORMAL = 1
+    BULK = 2  # media groups and other heavy uploads
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'paused_until')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, until):
+        self.paused_until = max(self.paused_until, until)
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.paused_until
+
+
+class _Job:
+    __slots__ = ('chat_id', 'priority', 'func', 'args', 'kwargs', 'future', 'attempts', 'context')
+
+    def __init__(self, chat_id, priority, func, args, kwargs, future):
+        self.context = contextvars.copy_context()  # the call runs with the caller's Bot, update, etc.
+        self.chat_id = chat_id
+        self.priority = priority
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+
+
+class SendScheduler:
+    """ Single outbound queue for Bot API calls with global and per-chat rate limits """
+
+    def __init__(self, rate=25, burst=30, chat_rate=1, chat_burst=3, max_retries=3, timer=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.timer = timer
+        self.retry_after_count = 0
+        self._queues = {priority: deque() for priority in Priority}
+        self._global = TokenBucket(rate, burst, timer())
+        self._chats: dict[int, TokenBucket] = {}
+        self._running: set[asyncio.Task] = set()
+        self._worker: asyncio.Task | None = None
+        self._wakeup: asyncio.Event | None = None
+
+    async def call(self, chat_id, func, *args, priority=Priority.NORMAL, **kwargs):
+        """
+        Queue `func(*args, **kwargs)` and wait for its result.
+        `func` is called again on RetryAfter, so it must build fresh arguments (e.g. InputFile) itself.
+        `chat_id` is None for calls that only count against the global limit.
+        """
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            # the worker outlives this caller, it must not keep the caller's context vars
+            self._worker = contextvars.Context().run(asyncio.ensure_future, self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].append(_Job(chat_id, priority, func, args, kwargs, future))
+        self._wakeup.set()
+        return await future
+
+    def _bucket(self, chat_id, now):
+        if (bucket := self._chats.get(chat_id)) is None:
+            if len(self._chats) > 10_000:
+                self._chats = {k: v for k, v in self._chats.items() if not v.idle(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    def _next_job(self):
+        """ (job, None) if something can be sent now, else (None, seconds to wait or None) """
+        now = self.timer()
+        if not any(self._queues.values()):
+            return None, None
+        if (delay := self._global.wait_time(now)) > 0:
+            return None, delay
+
+        for queue in self._queues.values():
+            for index, job in enumerate(queue):
+                if job.future.done():  # cancelled by the caller
+                    del queue[index]
+                    return self._next_job()
+                bucket = self._bucket(job.chat_id, now) if job.chat_id is not None else None
+                wait = bucket.wait_time(now) if bucket else 0.0
+                if wait == 0:
+                    del queue[index]
+                    self._global.take(now)
+                    if bucket:
+                        bucket.take(now)
+                    return job, None
+                delay = wait if delay <= 0 else min(delay, wait)
+        return None, delay
+
+    async def _run(self):
+        while True:
+            job, delay = self._next_job()
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = job.context.run(asyncio.ensure_future, self._execute(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _execute(self, job: _Job):
+        job.attempts += 1
+        try:
+            result = await job.func(*job.args, **job.kwargs)
+        except RetryAfter as e:
+            self.retry_after_count += 1
+            until = self.timer() + e.timeout
+            if job.chat_id is None:
+                self._global.pause(until)
+            else:
+                self._bucket(job.chat_id, self.timer()).pause(until)
+            if job.attempts > self.max_retries:
+                if not job.future.done():
+                    job.future.set_exception(e)
+                return
+            logger.warning(f"RetryAfter {e.timeout}s for chat {job.chat_id}, attempt {job.attempts}")
+            self._queues[job.priority].appendleft(job)
+            self._wakeup.set()
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+
+    def stats(self):
+        return {
+            "queued": {priority.name: len(queue) for priority, queue in self._queues.items()},
+            "running": len(self._running),
+            "chats": len(self._chats),
+            "retry_after": self.retry_after_count,
+        }
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+        for task in list(self._running):
+            task.cancel()
+        for queue in self._queues.values():
+            while queue:
+                queue.popleft().future.cancel()
+        self._worker = None
+
+
+scheduler = SendScheduler(
+    config.TG_RATE, config.TG_BURST,
+    config.TG_CHAT_RATE, config.TG_CHAT_BURST,
+    config.TG_MAX_RETRIES,
+)
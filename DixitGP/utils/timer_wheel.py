@@ -0,0 +1,37 @@
+import math
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel: `size` slots of `tick` seconds each.
+    Keys scheduled further than one turn away land in the last slot and are expected to be rescheduled.
+    """
+
+    def __init__(self, tick=60.0, size=64):
+        self.tick = tick
+        self.size = size
+        self.position = 0
+        self._slots = [set() for _ in range(size)]
+        self._where = {}  # key -> slot index
+
+    def schedule(self, key, delay):
+        self.cancel(key)
+        ticks = min(max(1, math.ceil(delay / self.tick)), self.size - 1)
+        index = (self.position + ticks) % self.size
+        self._slots[index].add(key)
+        self._where[key] = index
+
+    def cancel(self, key):
+        if (index := self._where.pop(key, None)) is not None:
+            self._slots[index].discard(key)
+
+    def advance(self):
+        """ Move one tick forward and return keys that are due """
+        self.position = (self.position + 1) % self.size
+        due, self._slots[self.position] = self._slots[self.position], set()
+        for key in due:
+            self._where.pop(key, None)
+        return due
+
+    def __len__(self):
+        return len(self._where)
@@ -1,32 +1,63 @@
+import functools
 from pathlib import Path
 
+import numpy as np
 from PIL import Image
 from PIL import ImageFont
 from PIL import ImageDraw
 
 local_path = Path(__file__).parent.resolve()
 
+MARKS_CACHE_SIZE = 256
+
+
+@functools.lru_cache(maxsize=32)
+def get_font(size):
+    return ImageFont.truetype(str(local_path / "ArianaVioleta-dz2K.ttf"), size)
+
+
+@functools.lru_cache(maxsize=MARKS_CACHE_SIZE)
 def get_circle_mark(text, size):
+    """ Rendered mark is shared between callers, do not modify it in place """
     mark = Image.new("RGBA", (size, size), (0, 0, 0, 0))
     draw = ImageDraw.Draw(mark)
     draw.ellipse((0, 0, size, size), fill=(255, 255, 255, 55))
-    font = ImageFont.truetype(str(local_path / "ArianaVioleta-dz2K.ttf"), int(size * 1.35))
+    font = get_font(int(size * 1.35))
     text_x, text_y, text_w, text_h = draw.multiline_textbbox((0, 0), text, font)
     draw.text(((size - text_w - text_x) // 2, (size - text_h - text_y) // 2), text, (0, 0, 0, 100), font=font)
     return mark
 
 
+@functools.lru_cache(maxsize=MARKS_CACHE_SIZE)
+def get_mark_layers(text, size):
+    """ Mark split into premultiplied colour and inverse alpha, ready for blending """
+    mark = np.asarray(get_circle_mark(text, size), dtype=np.float32)
+    alpha = mark[..., 3:] / 255
+    color, inverse_alpha = mark[..., :3] * alpha, 1 - alpha
+    color.flags.writeable = inverse_alpha.flags.writeable = False
+    return color, inverse_alpha
+
+
+def blend_mark(pixels, text, size, offset):
+    """ Blend mark into `pixels` (H x W x 3 uint8 array) in place, touching only its box """
+    color, inverse_alpha = get_mark_layers(text, size)
+    region = pixels[offset:offset + size, offset:offset + size]
+    height, width = region.shape[:2]
+    blended = region * inverse_alpha[:height, :width] + color[:height, :width]
+    np.rint(blended, out=blended)
+    region[...] = blended
+
+
 def get_marked_image(original, text):
-    text = str(text)
-    if original.mode != "RGBA":
-        img = Image.new("RGBA", original.size, (0, 0, 0, 0))
-        img.paste(original)
-        original = img
-    full_mark = Image.new("RGBA", original.size, (0, 0, 0, 0))
-    mark = get_circle_mark(text, int(min(original.size) * 0.30))
+    size = int(min(original.size) * 0.30)
     offset = int(min(original.size) * 0.05)
-    full_mark.paste(mark, (offset, offset))
-    return Image.alpha_composite(original, full_mark).convert("RGB")
+
+    image = original.convert("RGB")
+    box = (offset, offset, offset + size, offset + size)
+    region = np.array(image.crop(box))
+    blend_mark(region, str(text), size, 0)
+    image.paste(Image.fromarray(region), box[:2])
+    return image
 
 
 # image = Image.open("../photos/AQADrL8xGwOnyUt-")
@@ -0,0 +1,135 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import queue
+
+import aiogram
+from aiohttp import web
+
+from config_reader import config
+from logger import fork_log_file
+
+logger = logging.getLogger("webhook")
+
+CHAT_FIELDS = ('message', 'edited_message', 'channel_post', 'edited_channel_post', 'my_chat_member',
+               'chat_member', 'chat_join_request')
+USER_FIELDS = ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query')
+
+
+def update_chat_id(update: dict) -> int:
+    """ Chat an update belongs to, user id for updates without a chat """
+    for field in CHAT_FIELDS:
+        if field in update:
+            return update[field]['chat']['id']
+    if query := update.get('callback_query'):
+        if message := query.get('message'):
+            return message['chat']['id']
+        return query['from']['id']
+    for field in USER_FIELDS:
+        if field in update:
+            return update[field]['from']['id']
+    if answer := update.get('poll_answer'):
+        return answer['user']['id']
+    return 0
+
+
+def shard_of(update: dict, workers: int) -> int:
+    return update_chat_id(update) % workers
+
+
+def secret_token():
+    return hashlib.sha256(config.BOT_TOKEN.get_secret_value().encode()).hexdigest()[:32]
+
+
+async def run_front(queues, commands=()):
+    """ Accept Telegram webhooks and hand every update to the worker that owns its chat """
+    secret = secret_token()
+
+    async def handle(request: web.Request):
+        if request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret:
+            return web.Response(status=403)
+        try:
+            update = await request.json()
+        except ValueError:  # json.JSONDecodeError and UnicodeDecodeError
+            logger.warning("Malformed webhook body")
+            return web.Response(status=400)
+        if not isinstance(update, dict):
+            return web.Response(status=400)
+        try:
+            queues[shard_of(update, len(queues))].put_nowait(update)
+        except queue.Full:
+            logger.warning(f"Worker queue is full, update {update.get('update_id')} will be redelivered")
+            return web.Response(status=503)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(config.WEBHOOK_PATH, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT).start()
+
+    bot = aiogram.Bot(config.BOT_TOKEN.get_secret_value())
+    try:
+        await bot.set_webhook(config.WEBHOOK_URL + config.WEBHOOK_PATH, secret_token=secret,
+                              max_connections=config.WEBHOOK_MAX_CONNECTIONS)
+        if commands:
+            await bot.set_my_commands(list(commands))
+        logger.info(f"Webhook on {config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}, "
+                    f"{len(queues)} workers")
+        await asyncio.Event().wait()
+    finally:
+        await (await bot.get_session()).close()
+        await runner.cleanup()
+
+
+async def run_worker(dp: aiogram.Dispatcher, updates):
+    """ Process updates from the front, one chat at a time and many chats concurrently """
+    from utils.actors import Actors
+
+    aiogram.Bot.set_current(dp.bot)
+    aiogram.Dispatcher.set_current(dp)
+    loop = asyncio.get_running_loop()
+    chats = Actors()
+    running = set()
+    # updates taken but not processed yet, when all are busy the mp queue fills and the front answers 503
+    slots = asyncio.Semaphore(config.WEBHOOK_QUEUE_SIZE)
+
+    def _done(task):
+        running.discard(task)
+        slots.release()
+        if not task.cancelled() and (error := task.exception()):
+            logger.error(f"Update processing failed: {error!r}")
+
+    while True:
+        await slots.acquire()
+        if (update := await loop.run_in_executor(None, updates.get)) is None:
+            break
+        chat_id = update_chat_id(update)
+        task = asyncio.ensure_future(chats.run(chat_id, dp.process_update, aiogram.types.Update(**update)))
+        task.add_done_callback(_done)
+        running.add(task)
+
+    if running:
+        await asyncio.wait(running)
+
+
+def serve(worker_target, commands=()):
+    """ Fork `config.WORKERS` processes running `worker_target(index, updates)` and serve the webhook """
+    if not config.WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL is required in webhook mode")
+    context = multiprocessing.get_context('fork')  # main.py has no __main__ guard, spawn would re-run it
+    queues = [context.Queue(config.WEBHOOK_QUEUE_SIZE) for _ in range(config.WORKERS)]
+    workers = [context.Process(target=worker_target, args=(index, updates), name=f"worker-{index}", daemon=True)
+               for index, updates in enumerate(queues)]
+    for index, worker in enumerate(workers):
+        fork_log_file(index)
+        worker.start()
+    fork_log_file(None)
+    try:
+        asyncio.run(run_front(queues, commands))
+    finally:
+        for updates in queues:
+            updates.put(None)
+        for worker in workers:
+            worker.join(timeout=30)
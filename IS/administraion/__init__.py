@@ -1,6 +1,8 @@
 import asyncio
+import io
 import logging
 import shlex
+import time
 
 import aiogram
 from aiogram.utils.markdown import hpre
@@ -19,6 +21,10 @@ admins_ids.extend(
 def register(dp: aiogram.Dispatcher):
     dp.register_message_handler(get_logs, commands=['get_logs'], state="*")
     dp.register_message_handler(execute, commands=['exec'], state='*')
+    dp.register_message_handler(metrics, commands=['metrics'], state='*')
+    dp.register_message_handler(loop_stats, commands=['loop_stats'], state='*')
+    dp.register_message_handler(bench_report, commands=['bench_report'], state='*')
+    dp.register_message_handler(profile, commands=['profile'], state='*')
 
 
 async def get_logs(message: aiogram.types.Message):
@@ -50,6 +56,78 @@ async def execute(message: aiogram.types.Message):
     await message.reply(text)
 
 
+async def metrics(message: aiogram.types.Message):
+    if message.from_user.id not in admins_ids:
+        return
+    from utils.metrics import api_metrics
+
+    summary = api_metrics.summary()
+    if not summary:
+        return await message.reply("No API requests yet")
+    text = "endpoint            count  err  now   p50 ms   p95 ms   p99 ms   max ms"
+    for endpoint, m in summary.items():
+        text += (f"\n{endpoint[:18]:<18} {m['count']:>6} {m['errors']:>4} {m['in_flight']:>4}"
+                 f" {m['p50'] * 1000:>8.1f} {m['p95'] * 1000:>8.1f} {m['p99'] * 1000:>8.1f} {m['max'] * 1000:>8.1f}")
+    await message.reply(hpre(text))
+
+
+async def loop_stats(message: aiogram.types.Message):
+    if message.from_user.id not in admins_ids:
+        return
+    from utils.loop_monitor import loop_monitor
+
+    stats = loop_monitor.stats()
+    text = (f"Loop lag over {stats['samples']} samples: p50 {stats['p50'] * 1000:.1f} ms, "
+            f"p95 {stats['p95'] * 1000:.1f} ms, p99 {stats['p99'] * 1000:.1f} ms, max {stats['max'] * 1000:.1f} ms\n"
+            f"Slow callbacks: {stats['slow_callbacks']}")
+    for at, duration, name, handler, update_type in list(loop_monitor.slow)[-5:]:
+        text += (f"\n{time.strftime('%H:%M:%S', time.localtime(at))} {duration * 1000:>6.0f} ms {name}"
+                 + (f" ({handler}, {update_type})" if handler else ""))
+    await message.reply(hpre(text))
+
+
+async def bench_report(message: aiogram.types.Message):
+    if message.from_user.id not in admins_ids:
+        return
+    import logger as bot_logger
+
+    if message.get_args() == 'reset':
+        bot_logger.timings.clear()
+        bot_logger.failures.clear()
+        return await message.reply("Timings cleared")
+    rows = bot_logger.bench_report()
+    if not rows:
+        return await message.reply("Nothing timed yet")
+    text = "name                 calls  err  mean ms   p50 ms   p95 ms   p99 ms   max ms"
+    for name, calls, failed, mean, p50, p95, p99, longest in rows:
+        text += (f"\n{name[:20]:<20} {calls:>5} {failed:>4} {mean * 1000:>8.1f} {p50 * 1000:>8.1f}"
+                 f" {p95 * 1000:>8.1f} {p99 * 1000:>8.1f} {longest * 1000:>8.1f}")
+    await message.reply(hpre(text))
+
+
+async def profile(message: aiogram.types.Message):
+    """ /profile [seconds] [top] - sample the running loop and send collapsed stacks for a flamegraph """
+    if message.from_user.id not in admins_ids:
+        return
+    from utils import profiler
+
+    args = message.get_args().split()
+    try:
+        seconds = min(max(float(args[0]), 1.0), 120.0) if args else 10.0
+        top = int(args[1]) if len(args) > 1 else 15
+    except ValueError:
+        return await message.reply("Usage: /profile [seconds] [top]")
+    await message.reply(f"Profiling for {seconds:.0f} s")
+    try:
+        result = await profiler.profile(seconds)
+    except RuntimeError as e:
+        return await message.reply(str(e))
+    name = f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded"
+    await message.reply_document(aiogram.types.InputFile(io.BytesIO(result.collapsed().encode()), filename=name),
+                                 caption="flamegraph.pl or speedscope.app")
+    await message.reply(hpre(result.summary(top)[:4000]))
+
+
 async def on_startup(dp: aiogram.Dispatcher):
     for admin_id in admins_ids:
         await dp.bot.send_message(admin_id, "Started")
@@ -1,9 +1,12 @@
+import asyncio
 import logging
+import re
 
 import aiohttp
 import requests
 
 from config_reader import config
+from utils.metrics import api_metrics
 
 url = config.API_URL
 
@@ -19,25 +22,34 @@ class API:
         self.url = config.API_URL
 
     async def request(self, method, endpoint, token=None, **kwargs):
-        async with method(
-                self.url + endpoint,
-                # headers=self.get_default_headers(token or self.token),
-                **kwargs,
-        ) as resp:
-            logger.debug(f"API {endpoint!r} {kwargs} response status {resp.status}")
-            if not resp.ok:
+        name = re.sub(r'/[^/]+', '/{}', endpoint)  # user/42 -> user/{}, one series per endpoint
+        started, status = api_metrics.started(name), 'error'
+        try:
+            async with method(
+                    self.url + endpoint,
+                    # headers=self.get_default_headers(token or self.token),
+                    **kwargs,
+            ) as resp:
+                status = resp.status
+                logger.debug("API %r %s response status %s", endpoint, kwargs, resp.status)
+                if not resp.ok:
+                    try:
+                        error = await resp.json()
+                    except aiohttp.ContentTypeError:
+                        error = await resp.text()
+                    logger.error(str(error).replace('<', r'\<'))
+                    raise APIError(error)
                 try:
-                    error = await resp.json()
+                    data = await resp.json()
                 except aiohttp.ContentTypeError:
-                    error = await resp.text()
-                logger.error(str(error).replace('<', r'\<'))
-                raise APIError(error)
-            try:
-                data = await resp.json()
-            except aiohttp.ContentTypeError:
-                data = await resp.text()
-            if isinstance(data, dict) and not data.get("ok", True):
-                raise APIError(data)
+                    data = await resp.text()
+                if isinstance(data, dict) and not data.get("ok", True):
+                    raise APIError(data)
+        except asyncio.TimeoutError:
+            status = 'timeout'
+            raise
+        finally:
+            api_metrics.finished(name, started, status)
         return data
 
     async def get_user(self, session, user_id: int):
@@ -5,6 +5,12 @@ class Settings(BaseSettings):
     BOT_TOKEN: SecretStr
     ADMINS_IDS: str
     API_URL: str
+    METRICS_HOST: str = '127.0.0.1'
+    METRICS_PORT: int = 0  # prometheus /metrics endpoint, 0 - disabled
+
+    LOOP_MONITOR_INTERVAL: float = 0.1  # seconds between loop lag samples
+    LOOP_MONITOR_WINDOW: float = 600  # seconds of samples kept for percentiles
+    LOOP_SLOW_CALLBACK: float = 0.1  # callbacks running longer than this are logged
 
     class Config:
         env_file = '.env'
@@ -59,7 +59,7 @@ async def start_booking(edit_query_message=False):
 
 async def address_selected(call: CallbackQuery):
     user_id = call.message.chat.id
-    logger.info(f"address_selected by user {user_id}")
+    logger.info("address_selected by user %s", user_id)
     rows = call.message.reply_markup.inline_keyboard
     clicked = next(filter(lambda x: x.callback_data == call.data,
                           [b for r in rows for b in r]))
@@ -100,7 +100,7 @@ async def start_date_selection():
 async def date_selected(call: CallbackQuery, callback_data):
     user_id = call.message.chat.id
     date = callback_data.get("args")
-    logger.info(f"date_selected by user {user_id}: {date}")
+    logger.info("date_selected by user %s: %s", user_id, date)
 
     state = Dispatcher.get_current().current_state()
     async with state.proxy() as data:
@@ -117,7 +117,7 @@ async def start_barber_selection(page=0):
 
     async with aiohttp.ClientSession() as session:
         barbers = await api.get_barbers(session, date)
-        logger.info(f"Barbers on {date}: {barbers}")
+        logger.info("Barbers on %s: %s", date, barbers)
 
     markup = Markup(row_width=1)
     barbers_per_page = 2
@@ -147,7 +147,7 @@ async def start_barber_selection(page=0):
 async def barber_selected(call: CallbackQuery, callback_data):
     user_id = call.message.chat.id
     barber = callback_data.get("args")
-    logger.info(f"barber_selected by user {user_id}: {barber}")
+    logger.info("barber_selected by user %s: %s", user_id, barber)
 
     state = Dispatcher.get_current().current_state()
     async with state.proxy() as data:
@@ -165,7 +165,7 @@ async def start_choice_time():
 
     async with aiohttp.ClientSession() as session:
         free_time = await api.get_barber_free_time(session, barber, date)
-        logger.info(f"Barber {barber} at {date} free_time: {free_time}")
+        logger.info("Barber %s at %s free_time: %s", barber, date, free_time)
 
     working_time = [i for i in free_time if 9 <= i <= 20]
     markup = Markup(row_width=3)
@@ -180,7 +180,7 @@ async def start_choice_time():
 async def time_selected(call: CallbackQuery, callback_data):
     user_id = call.message.chat.id
     time = callback_data.get("args")
-    logger.info(f"time_selected by user {user_id}: {time}")
+    logger.info("time_selected by user %s: %s", user_id, time)
 
     state = Dispatcher.get_current().current_state()
     async with state.proxy() as data:
@@ -210,7 +210,7 @@ async def request_confirmation():
 
 async def confirm(call: CallbackQuery):
     user_id = call.message.chat.id
-    logger.info(f"confirm by user {user_id}")
+    logger.info("confirm by user %s", user_id)
     state = Dispatcher.get_current().current_state()
     async with state.proxy() as data:
         location = data['location']
@@ -233,7 +233,7 @@ async def confirm(call: CallbackQuery):
 
 async def back(call: CallbackQuery, callback_data):
     user_id = call.message.chat.id
-    logger.info(f"back by user {user_id}, {callback_data}")
+    logger.info("back by user %s, %s", user_id, callback_data)
     match callback_data['args'].split("_"):
         case ["locations"]:
             await start_booking(edit_query_message=True)
@@ -1,20 +1,157 @@
+import atexit
+import copy
 import functools
+import inspect
 import logging
 import os
+import queue
+import random
 import sys
 import time
-from logging.handlers import RotatingFileHandler
+from collections import defaultdict
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+from utils.metrics import Histogram
 
 FOLDER = 'logs'
 FILE_NAME = 'bot.log'
 LEVEL = logging.INFO
+QUEUE_SIZE = 10_000  # records waiting for the writer thread
+BATCH_SIZE = 512  # records written with one write + flush
+
+_listener: QueueListener | None = None
+timings: dict[str, Histogram] = defaultdict(Histogram)  # `benchmark` name -> durations
+failures: dict[str, int] = defaultdict(int)
 
 
 def get_path():
     return os.path.join(FOLDER, FILE_NAME)
 
 
+class DroppingQueueHandler(QueueHandler):
+    """
+    Puts records on a bounded queue without blocking the caller. When the queue is full records below WARNING
+    are dropped, warnings and errors push out the oldest queued record instead.
+    """
+
+    def __init__(self, queue_):
+        super().__init__(queue_)
+        self.dropped = 0
+
+    def prepare(self, record):
+        """
+        Merge the arguments into the message and render the traceback now, in the caller's thread:
+        arguments may change once the caller goes on and a queued traceback keeps all its frames alive.
+        The rest of formatting and the writes happen in the writer thread
+        """
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = (self.formatter or logging.Formatter()).formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            self.dropped += 1
+            if record.levelno < logging.WARNING:
+                return
+        try:
+            self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+class _BatchMixin:
+    terminator: str
+
+    def emit_many(self, records):
+        records = [record for record in records if record.levelno >= self.level and self.filter(record)]
+        if not records:
+            return
+        try:
+            text = "".join(self.format(record) + self.terminator for record in records)
+            self.acquire()
+            try:
+                self.write(text)
+            finally:
+                self.release()
+        except Exception:
+            self.handleError(records[-1])
+
+
+class BatchStreamHandler(_BatchMixin, logging.StreamHandler):
+    def write(self, text):
+        self.stream.write(text)
+        self.flush()
+
+
+class BatchRotatingFileHandler(_BatchMixin, RotatingFileHandler):
+    def write(self, text):
+        if self.stream is None:
+            self.stream = self._open()
+        if self.maxBytes and self.stream.tell() + len(text) >= self.maxBytes:
+            self.doRollover()
+        self.stream.write(text)
+        self.flush()
+
+
+class BatchQueueListener(QueueListener):
+    """ Writer thread: takes everything queued so far and hands it to the handlers as one batch """
+
+    def __init__(self, queue_, *handlers, queue_handler: DroppingQueueHandler | None = None):
+        super().__init__(queue_, *handlers, respect_handler_level=True)
+        self.queue_handler = queue_handler
+        self._reported_drops = 0
+
+    def _monitor(self):
+        has_task_done = hasattr(self.queue, 'task_done')
+        stop = False
+        while not stop:
+            batch = [self.dequeue(True)]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.dequeue(False))
+                except queue.Empty:
+                    break
+            taken = len(batch)
+            if self._sentinel in batch:
+                stop = True
+                batch = [record for record in batch if record is not self._sentinel]
+            if self.queue_handler is not None and (dropped := self.queue_handler.dropped - self._reported_drops):
+                self._reported_drops += dropped
+                batch.append(logging.makeLogRecord({
+                    'name': 'logger', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': 'Log queue is full, dropped %d records', 'args': (dropped,),
+                }))
+            self.handle_batch(batch)
+            if has_task_done:
+                for _ in range(taken):
+                    self.queue.task_done()
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)  # the queue may be full, waiting for the writer is fine on shutdown
+
+    def handle_batch(self, records):
+        for handler in self.handlers:
+            if hasattr(handler, 'emit_many'):
+                handler.emit_many(records)
+            else:
+                for record in records:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+
+
 def init_logging():
+    global _listener
     os.makedirs(FOLDER, exist_ok=True)
 
     logger = logging.root
@@ -24,26 +161,123 @@ def init_logging():
         '%(levelname)-6s [%(asctime)s] %(message)-100s      <%(name)s:%(filename)s:%(lineno)d ~%(threadName)s~>')
 
     path = get_path()
-    fh = RotatingFileHandler(path, maxBytes=30 * 1024 * 1024, backupCount=1, encoding="utf-8")
+    fh = BatchRotatingFileHandler(path, maxBytes=30 * 1024 * 1024, backupCount=1, encoding="utf-8")
     fh.setFormatter(formatter)
-    logger.addHandler(fh)
 
-    ch = logging.StreamHandler(stream=sys.stdout)
+    ch = BatchStreamHandler(stream=sys.stdout)
     ch.setFormatter(formatter)
-    logger.addHandler(ch)
+
+    # the loop only puts records on a queue, formatting, writes and rotation happen in the writer thread
+    records = queue.Queue(QUEUE_SIZE)
+    qh = DroppingQueueHandler(records)
+    qh.setFormatter(formatter)  # only its formatException is used, see `prepare`
+    logger.addHandler(qh)
+    _listener = BatchQueueListener(records, fh, ch, queue_handler=qh)
+    _listener.start()
+    atexit.register(stop_logging)
 
     return logger
 
 
-def benchmark(message, log_func):
+def _restart_in_child():
+    """ Forked webhook workers get no writer thread, give them their own queue and writer """
+    global _listener
+    if _listener is None:
+        return
+    handler = _listener.queue_handler
+    handler.queue = records = queue.Queue(QUEUE_SIZE)
+    _listener = BatchQueueListener(records, *_listener.handlers, queue_handler=handler)
+    _listener.start()
+
+
+os.register_at_fork(after_in_child=_restart_in_child)
+
+
+def stop_logging():
+    """ Write out everything still queued and stop the writer thread """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+    _listener = None
+
+
+def benchmark(message, log_func=None, sample=1.0):
+    """
+    Time calls of a function, coroutine function or async generator function into `timings[message]`.
+    Async generators are timed by the time spent inside them, not while the consumer holds the item.
+    `sample` - share of calls that are timed, `log_func` - also log every timed call, like it used to.
+    """
+    def _timed():
+        return sample >= 1 or random.random() < sample
+
+    def _record(elapsed, kwargs, failed):
+        timings[message].observe(elapsed)
+        if failed:
+            failures[message] += 1
+        if log_func is not None:
+            log_func('%s %s %0.2fs', message, kwargs, elapsed)
+
     def _wrap(func):
-        @functools.wraps(func)
-        def _new_func(*args, **kwargs):
-            start = time.time()
-            result = func(*args, **kwargs)
-            log_func(f'{message} {kwargs} {time.time() - start:0.2f}s')
-            return result
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def _new_func(*args, **kwargs):
+                if not _timed():
+                    async for item in func(*args, **kwargs):
+                        yield item
+                    return
+                generator, busy, failed = func(*args, **kwargs), 0.0, False
+                try:
+                    while True:
+                        started = time.perf_counter()
+                        try:
+                            item = await generator.__anext__()
+                        except StopAsyncIteration:
+                            break
+                        except Exception:  # cancellation is not a failure
+                            failed = True
+                            raise
+                        finally:
+                            busy += time.perf_counter() - started
+                        yield item
+                finally:
+                    await generator.aclose()
+                    _record(busy, kwargs, failed)
+
+        elif inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def _new_func(*args, **kwargs):
+                if not _timed():
+                    return await func(*args, **kwargs)
+                started, failed = time.perf_counter(), False
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    failed = True
+                    raise
+                finally:
+                    _record(time.perf_counter() - started, kwargs, failed)
+
+        else:
+            @functools.wraps(func)
+            def _new_func(*args, **kwargs):
+                if not _timed():
+                    return func(*args, **kwargs)
+                started, failed = time.perf_counter(), False
+                try:
+                    return func(*args, **kwargs)
+                except Exception:
+                    failed = True
+                    raise
+                finally:
+                    _record(time.perf_counter() - started, kwargs, failed)
 
         return _new_func
 
     return _wrap
+
+
+def bench_report():
+    """ [(name, calls, failures, mean, p50, p95, p99, max)] slowest total first, seconds """
+    rows = [(name, h.count, failures[name], h.sum / h.count, h.quantile(0.5), h.quantile(0.95), h.quantile(0.99),
+             h.max) for name, h in timings.items() if h.count]
+    return sorted(rows, key=lambda row: row[1] * row[3], reverse=True)
@@ -17,7 +17,7 @@ async def error_handler(update: aiogram.types.Update, exception):
         await update.callback_query.answer("🤨", show_alert=True)
         message = update.callback_query.message
 
-    logger.exception(f"error_handler: {exception!r}. {update}")
+    logger.exception("error_handler: %r. %s", exception, update)
     await update.bot.send_message(738016227, f'{message.chat} fails:\n{exception!r}')
     await message.reply("🤨")
     return True
@@ -50,12 +50,20 @@ async def _main():
     logger.info(f"Starting bot... {await dp.bot.get_me()}")
     await set_commands(dp.bot)
     import administraion
-    await administraion.on_startup(dp)
+    from utils import metrics
+    from utils.loop_monitor import loop_monitor
     try:
+        # inside, so a failed start is cleaned up before the reconnect
+        loop_monitor.start()
+        await administraion.on_startup(dp)
+        if config.METRICS_PORT:
+            await metrics.start_server(config.METRICS_HOST, config.METRICS_PORT)
         await dp.start_polling()
     except BaseException as error:
         raise error
     finally:
+        await metrics.stop_server()
+        loop_monitor.stop()
         del dp
 
 
@@ -0,0 +1,138 @@
+import bisect
+import logging
+import time
+from collections import defaultdict
+
+from aiohttp import web
+
+logger = logging.getLogger("metrics")
+
+# log spaced bucket bounds in seconds, each 2 ** (1 / 4) ~ 19% wider than the previous, 100 us .. ~100 s
+BUCKETS = tuple(0.0001 * 2 ** (i / 4) for i in range(81))
+EXPORT_STEP = 4  # prometheus gets every 4th bound (powers of two), 81 series per endpoint is too many
+
+
+class Histogram:
+    """ Fixed buckets, observe is one bisect; quantiles are accurate to a bucket width """
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(BUCKETS[index], self.max) if index < len(BUCKETS) else self.max
+        return self.max
+
+    def cumulative(self, step=EXPORT_STEP):
+        """ [(upper bound, count of values <= bound)], ends with +Inf """
+        result, seen = [], 0
+        for index, count in enumerate(self.counts[:-1]):
+            seen += count
+            if index % step == step - 1:
+                result.append((BUCKETS[index], seen))
+        result.append((float('inf'), self.count))
+        return result
+
+
+class RequestMetrics:
+    """ Per endpoint latency histograms, status counts and requests in flight """
+
+    def __init__(self, prefix='api'):
+        self.prefix = prefix
+        self.latency: dict[str, Histogram] = defaultdict(Histogram)
+        self.statuses: dict[tuple[str, str], int] = defaultdict(int)
+        self.in_flight: dict[str, int] = defaultdict(int)
+
+    def started(self, endpoint):
+        self.in_flight[endpoint] += 1
+        return time.perf_counter()
+
+    def finished(self, endpoint, started, status):
+        """ `status` is the HTTP status or a short error name like 'timeout' """
+        self.in_flight[endpoint] -= 1
+        self.latency[endpoint].observe(time.perf_counter() - started)
+        self.statuses[endpoint, str(status)] += 1
+
+    def summary(self):
+        """ {endpoint: {count, errors, in_flight, p50, p95, p99, max}}, latencies in seconds """
+        errors = defaultdict(int)
+        for (endpoint, status), count in self.statuses.items():
+            if not status.isdigit() or int(status) >= 400:
+                errors[endpoint] += count
+        return {
+            endpoint: {
+                "count": histogram.count,
+                "errors": errors[endpoint],
+                "in_flight": self.in_flight[endpoint],
+                "p50": histogram.quantile(0.5),
+                "p95": histogram.quantile(0.95),
+                "p99": histogram.quantile(0.99),
+                "max": histogram.max,
+            }
+            for endpoint, histogram in sorted(self.latency.items())
+        }
+
+    def prometheus(self):
+        name = f"{self.prefix}_request_duration_seconds"
+        lines = [f"# TYPE {name} histogram"]
+        for endpoint, histogram in sorted(self.latency.items()):
+            for bound, count in histogram.cumulative():
+                le = "+Inf" if bound == float('inf') else f"{bound:.6g}"
+                lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{le}"}} {count}')
+            lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {histogram.sum:.6f}')
+            lines.append(f'{name}_count{{endpoint="{endpoint}"}} {histogram.count}')
+
+        lines.append(f"# TYPE {self.prefix}_requests_total counter")
+        for (endpoint, status), count in sorted(self.statuses.items()):
+            lines.append(f'{self.prefix}_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+
+        lines.append(f"# TYPE {self.prefix}_requests_in_flight gauge")
+        for endpoint, count in sorted(self.in_flight.items()):
+            lines.append(f'{self.prefix}_requests_in_flight{{endpoint="{endpoint}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+api_metrics = RequestMetrics('api')
+collectors = [api_metrics]  # anything with .prometheus(), served by `start_server`
+_runner: web.AppRunner | None = None
+
+
+async def _handle(request: web.Request):
+    text = "".join(collector.prometheus() for collector in collectors)
+    return web.Response(text=text, content_type="text/plain", charset="utf-8")
+
+
+async def start_server(host, port):
+    """ Prometheus text exposition on http://host:port/metrics """
+    global _runner
+    if _runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _handle)
+    _runner = web.AppRunner(app)
+    await _runner.setup()
+    await web.TCPSite(_runner, host, port).start()
+    logger.info(f"Metrics on http://{host}:{port}/metrics")
+
+
+async def stop_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+    _runner = None
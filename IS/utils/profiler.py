@@ -0,0 +1,151 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+MAX_DEPTH = 128
+IDLE_FILES = ('selectors.py',)  # the loop waiting for I/O
+CALLBACK_FRAME = 'events.py:Handle._run'  # frames above it are the loop itself
+
+
+class Profile:
+    """
+    Statistical profile of the event loop thread. A sampler thread looks at the loop's stack every `interval`
+    seconds and notes which task was running, every `await_every` samples it also notes where every other task
+    is suspended. Samples are weighted by the wall-clock time since the previous one, in microseconds:
+    the sampler needs the GIL, so a long callback delays it and would be under-counted otherwise.
+    """
+
+    def __init__(self, interval=0.005, await_every=10):
+        self.interval = interval
+        self.await_every = await_every
+        self.cpu = Counter()  # (task, frame, ..., frame) -> us
+        self.awaits = Counter()  # (task, coroutine, ..., awaited) -> us
+        self.samples = 0
+        self.total = 0
+        self.duration = 0.0
+        self._labels = {}
+
+    async def run(self, seconds):
+        loop = asyncio.get_running_loop()
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample, args=(loop, threading.get_ident(), stop),
+                                   name="profiler", daemon=True)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            await loop.run_in_executor(None, sampler.join)
+            self.duration = time.perf_counter() - started
+        return self
+
+    def _label(self, code):
+        if (label := self._labels.get(code)) is None:
+            name = getattr(code, 'co_qualname', code.co_name)  # co_qualname is 3.11+, the image runs 3.10
+            label = self._labels[code] = f"{os.path.basename(code.co_filename)}:{name}"
+        return label
+
+    @staticmethod
+    def _task_name(task):
+        coro = task.get_coro()
+        return getattr(coro, '__qualname__', None) or task.get_name()
+
+    def _sample(self, loop, thread_id, stop):
+        last = last_awaits = time.perf_counter()
+        while not stop.wait(self.interval):
+            now = time.perf_counter()
+            weight, last = round((now - last) * 1e6), now
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                return
+            task = asyncio.current_task(loop)
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            del frame
+            stack.append(f"task {self._task_name(task)}" if task else "no task")
+            self.cpu[tuple(reversed(stack))] += weight
+            self.samples += 1
+            self.total += weight
+            if self.await_every and self.samples % self.await_every == 0:
+                self._sample_awaits(loop, task, round((now - last_awaits) * 1e6))
+                last_awaits = now
+
+    def _sample_awaits(self, loop, running, weight):
+        try:
+            tasks = asyncio.all_tasks(loop)
+        except RuntimeError:  # the set kept changing under us
+            return
+        for task in tasks:
+            if task is running or task.done():
+                continue
+            chain, awaited = [f"task {self._task_name(task)}"], task.get_coro()
+            while awaited is not None and len(chain) < MAX_DEPTH:
+                if code := getattr(awaited, 'cr_code', None) or getattr(awaited, 'ag_code', None):
+                    chain.append(self._label(code))
+                else:
+                    chain.append(type(awaited).__name__)  # a future or something else at the bottom
+                awaited = getattr(awaited, 'cr_await', None) or getattr(awaited, 'ag_await', None)
+            self.awaits[tuple(chain)] += weight
+
+    def _idle(self, stack):
+        return stack[-1].split(':', 1)[0] in IDLE_FILES
+
+    def collapsed(self) -> str:
+        """ Brendan Gregg's collapsed stacks, feed to flamegraph.pl or speedscope """
+        lines = [";".join(("cpu",) + stack) + f" {count}" for stack, count in self.cpu.most_common()]
+        lines += [";".join(("await",) + chain) + f" {count}" for chain, count in self.awaits.most_common()]
+        return "\n".join(lines) + "\n"
+
+    def summary(self, top=15) -> str:
+        if not self.total:
+            return "No samples"
+        idle = sum(count for stack, count in self.cpu.items() if self._idle(stack))
+        busy = self.total - idle
+        tasks, own, total = Counter(), Counter(), Counter()
+        for stack, count in self.cpu.items():
+            if self._idle(stack):
+                continue
+            tasks[stack[0]] += count
+            own[stack[-1]] += count
+            callback = len(stack) - stack[::-1].index(CALLBACK_FRAME) if CALLBACK_FRAME in stack else 1
+            for label in set(stack[callback:]):
+                total[label] += count
+        waiting = Counter()
+        for chain, count in self.awaits.items():
+            waiting[f"{chain[0]} > {chain[-2] if len(chain) > 2 else chain[-1]}"] += count
+
+        def _table(title, counter, base):
+            rows = [f"\n{title}"]
+            rows += [f"{count / base:>6.1%}  {label}" for label, count in counter.most_common(top)]
+            return rows
+
+        lines = [f"{self.duration:.1f} s, {self.samples} samples every {self.interval * 1000:.0f} ms, "
+                 f"loop busy {busy / self.total:.1%}"]
+        if busy:
+            lines += _table("Busy by task:", tasks, busy)
+            lines += _table("Self time:", own, busy)
+            lines += _table("Total time:", total, busy)
+        if waiting:
+            lines += _table("Waiting (task > awaiting in), share of the time:", waiting, self.total)
+        return "\n".join(lines)
+
+
+_running = False
+
+
+async def profile(seconds, interval=0.005):
+    """ Profile the running loop for `seconds`, one profile at a time """
+    global _running
+    if _running:
+        raise RuntimeError("Profiler is already running")
+    _running = True
+    try:
+        return await Profile(interval).run(seconds)
+    finally:
+        _running = False